@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+发布时间提取: utils.date_extract 与原有 DATETIME_REGEXES + dateparser 逐条比对结果并计时
+python -m benchmarks.bench_date_extract [--rounds=5]
+"""
+import re
+import time
+import fire
+import dateparser
+from utils.settings import DATETIME_REGEXES
+from utils.date_extract import extract_datetime
+
+SAMPLES = [
+    '2023-01-05 10:20:30',
+    '2023-01-05 21:30:59',
+    '2023-01-05 09:05',
+    '2023-01-05 23:59',
+    '2023/1/5',
+    '2023.01.05',
+    '2023-1-5 8:00:00',
+    '[发布日期] 2021-12-31',
+    '[发布日期]\xa02022-06-01',
+    '发布时间：2022-06-01 来源：北京市人力资源和社会保障局',
+    '发布日期：2023年1月5日',
+    '2023年01月05日 09:05',
+    '2023年01月05日 21:05:33',
+    '23-01-05',
+    '23年1月5日',
+    '10月5日',
+    '10月5日 08:30',
+    '发布于 2023-01-05，更新 2023-02-01 10:00:00',
+    '2023-13-45',
+    '无日期',
+    '',
+]
+
+
+def legacy_extract(text):
+    """原有逻辑: 依次尝试 DATETIME_REGEXES, 命中后交给 dateparser"""
+    for regex in DATETIME_REGEXES:
+        result = re.search(regex, text)
+        if result:
+            return dateparser.parse(result.group(1))
+    return None
+
+
+def check():
+    """逐条比对, 返回不一致的样本"""
+    mismatches = list()
+    for text in SAMPLES:
+        expected, actual = legacy_extract(text), extract_datetime(text)
+        if expected != actual:
+            mismatches.append((text, expected, actual))
+    return mismatches
+
+
+def timed(func, texts, rounds):
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for text in texts:
+            func(text)
+    return time.perf_counter() - start
+
+
+def main(rounds=5):
+    # 记录首次调用(含 dateparser 初始化)的耗时
+    first_legacy = timed(legacy_extract, SAMPLES[:1], 1)
+    first_extract = timed(extract_datetime.__wrapped__, SAMPLES[:1], 1)
+
+    mismatches = check()
+    for text, expected, actual in mismatches:
+        print(f"MISMATCH {text!r}: legacy={expected}, extract={actual}")
+    print(f"correctness: {len(SAMPLES) - len(mismatches)}/{len(SAMPLES)} samples agree")
+
+    legacy = timed(legacy_extract, SAMPLES, rounds)
+    uncached = timed(extract_datetime.__wrapped__, SAMPLES, rounds)
+    cached = timed(extract_datetime, SAMPLES, rounds)
+    calls = len(SAMPLES) * rounds
+    print(f"first call       legacy {first_legacy * 1000:9.2f} ms   extract {first_extract * 1000:9.2f} ms")
+    print(f"legacy           {legacy / calls * 1e6:9.1f} us/call")
+    print(f"extract          {uncached / calls * 1e6:9.1f} us/call  ({legacy / uncached:.1f}x)")
+    print(f"extract (cached) {cached / calls * 1e6:9.1f} us/call  ({legacy / cached:.1f}x)")
+
+
+if __name__ == '__main__':
+    fire.Fire(main)
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+bjrs 详情页解析: parse_page(逐元素查询) 与 extract='evaluate'(一次往返) 的耗时与浏览器往返次数对比
+页面来自 benchmarks/fixtures/bjrs, 通过 page.route 提供, 不访问网络
+PYTHONPATH=.:src python -m benchmarks.bench_parse_page [--rounds=20]
+"""
+import time
+import fire
+from pathlib import Path
+from pyquery import PyQuery as Pq
+from playwright.sync_api import sync_playwright
+from playwright._impl._connection import Connection
+from website.bjrs.zfgb import ZFGBSpider
+from website.bjrs.fkzn import FKZNSpider
+from website.bjrs.gsgg import GSGGSpider
+from utils.browser import MARK_HIDDEN_SCRIPT
+
+FIXTURES = Path(__file__).absolute().parent / 'fixtures' / 'bjrs'
+ORIGIN = 'http://fixtures.local/'
+CASES = [
+    (ZFGBSpider, 'zfgb_detail.html'),
+    (FKZNSpider, 'fkzn_detail.html'),
+    (GSGGSpider, 'gsgg_detail.html'),
+]
+
+
+class RoundTrips(object):
+    """统计发往浏览器的消息数"""
+    count = 0
+
+    @classmethod
+    def install(cls):
+        send = Connection._send_message_to_server
+
+        def _counted(self, *args, **kwargs):
+            cls.count += 1
+            return send(self, *args, **kwargs)
+        Connection._send_message_to_server = _counted
+
+
+def bare_spider(cls):
+    """只用于解析的爬虫实例, 不连接数据库、不启动浏览器"""
+    return cls.offline()
+
+
+def serve_fixtures(route):
+    path = FIXTURES / route.request.url[len(ORIGIN):]
+    if path.is_file():
+        route.fulfill(status=200, content_type='text/html; charset=utf-8', body=path.read_text(encoding='utf-8'))
+    else:
+        route.fulfill(status=404, body='')
+
+
+def parse_dom(spider, page):
+    return spider.parse_page(page, 'benchmark')
+
+
+def parse_evaluate(spider, page):
+    html = page.evaluate(MARK_HIDDEN_SCRIPT, spider.content_selector)
+    return spider.parse_html(Pq(html, parser='html'), page.url, 'benchmark')
+
+
+def measure(func, spider, page, rounds):
+    RoundTrips.count = 0
+    start = time.perf_counter()
+    for _ in range(rounds):
+        record = func(spider, page)
+        if hasattr(spider, 'img'):
+            spider.img.clear()
+    elapsed = time.perf_counter() - start
+    return record, elapsed / rounds, RoundTrips.count / rounds
+
+
+def main(rounds=20, headless=True):
+    RoundTrips.install()
+    with sync_playwright() as p:
+        browser = p.firefox.launch(headless=headless)
+        page = browser.new_page()
+        page.route(f'{ORIGIN}**', serve_fixtures)
+        for cls, fixture in CASES:
+            page.goto(ORIGIN + fixture)
+            spider = bare_spider(cls)
+            dom, dom_time, dom_trips = measure(parse_dom, spider, page, rounds)
+            evaluate, evaluate_time, evaluate_trips = measure(parse_evaluate, spider, page, rounds)
+            fields = ('title', 'page_source', 'page_release_date', 'content')
+            same = all(dom[field] == evaluate[field] for field in fields)
+            print(f"{cls.__name__:12s} dom {dom_time * 1000:8.2f} ms {dom_trips:6.0f} round trips | "
+                  f"evaluate {evaluate_time * 1000:8.2f} ms {evaluate_trips:4.0f} round trips | "
+                  f"same record: {same}")
+        browser.close()
+
+
+if __name__ == '__main__':
+    fire.Fire(main)
@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+本地替身服务器
+提供 benchmarks/fixtures 下的页面(其中的 {{origin}} 替换为服务器地址), 其余图片、文档路径返回按路径生成的固定内容,
+基准测试不访问网络.
+with StandInServer() as server:
+    server.url('wechat/article.html')
+"""
+import hashlib
+import threading
+from pathlib import Path
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+FIXTURES = Path(__file__).absolute().parent / 'fixtures'
+BINARY_TYPES = {
+    '.png': 'image/png', '.jpg': 'image/jpeg', '.jpeg': 'image/jpeg', '.gif': 'image/gif', '.webp': 'image/webp',
+    '.pdf': 'application/pdf', '.doc': 'application/msword', '.docx': 'application/octet-stream',
+    '.xls': 'application/vnd.ms-excel', '.xlsx': 'application/octet-stream', '.zip': 'application/zip',
+}
+
+
+def binary_body(path, size):
+    """按路径生成的固定内容, 同一路径每次相同"""
+    seed = hashlib.sha256(path.encode('utf-8')).digest()
+    return (seed * (size // len(seed) + 1))[:size]
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        path = self.path.split('?', 1)[0]
+        fixture = (FIXTURES / path.lstrip('/')).resolve()
+        if fixture.is_file() and FIXTURES in fixture.parents:
+            body = fixture.read_text(encoding='utf-8').replace('{{origin}}', self.server.origin).encode('utf-8')
+            return self._send(200, 'text/html; charset=utf-8', body)
+        suffix = Path(path).suffix.lower()
+        if suffix in BINARY_TYPES:
+            return self._send(200, BINARY_TYPES[suffix], binary_body(path, self.server.attachment_size))
+        self._send(404, 'text/plain', b'not found')
+
+    def _send(self, status, content_type, body):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class StandInServer(object):
+    def __init__(self, host='127.0.0.1', port=0, attachment_size=64 * 1024):
+        """
+        :param host:
+        :param port: 0 时由系统分配
+        :param attachment_size: 生成的图片、文档的字节数
+        """
+        self.httpd = ThreadingHTTPServer((host, port), _Handler)
+        self.httpd.daemon_threads = True
+        self.httpd.attachment_size = attachment_size
+        self.origin = 'http://{}:{}'.format(*self.httpd.server_address)
+        self.httpd.origin = self.origin
+        self._thread = None
+
+    def url(self, path):
+        return f'{self.origin}/{path.lstrip("/")}'
+
+    def start(self):
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
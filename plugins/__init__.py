@@ -0,0 +1,50 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+爬虫注册表
+bjrs 等站点爬虫(BrowserBase 子类)通过 @register_spider 注册,
+公众号每个 biz 注册一个 ArticleSpider 任务; run.py 导入 SPIDER_MODULES 后统一调度.
+"""
+import importlib
+from collections import namedtuple
+
+SPIDER_MODULES = [
+    'src.api.article',
+    'src.website.bjrs.zfgb',
+    'src.website.bjrs.fkzn',
+    'src.website.bjrs.gsgg',
+]
+# kind: session - 普通 HTTP 任务, handler(**kwargs); browser - 浏览器爬虫类, handler(playwright, headless)
+SpiderEntry = namedtuple('SpiderEntry', ['name', 'kind', 'handler', 'kwargs', 'title'])
+SPIDERS = dict()
+
+
+def register(name, kind, handler, title=None, **kwargs):
+    """
+    注册爬虫
+    :param name: 唯一名称, 如 bjrs.zfgb、article.<biz>
+    :param kind: session / browser
+    :param handler:
+    :param title: 日志中显示的名称
+    :param kwargs: 调用 handler 时的参数
+    :return:
+    """
+    if name in SPIDERS:
+        raise RuntimeError(f"spider already registered: {name}")
+    SPIDERS[name] = SpiderEntry(name, kind, handler, kwargs, title or name)
+    return SPIDERS[name]
+
+
+def register_spider(name, title=None):
+    """浏览器爬虫类注册装饰器"""
+    def decorator(cls):
+        register(name, 'browser', cls, title=title)
+        return cls
+    return decorator
+
+
+def load_spiders(modules=None):
+    """导入爬虫模块, 模块导入时完成注册"""
+    for module in modules or SPIDER_MODULES:
+        importlib.import_module(module)
+    return SPIDERS
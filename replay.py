@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+离线重新解析
+按数据库中记录的 record_path 读取保存的页面(记录目录中的 html 或归档), 在进程池中用爬虫的解析逻辑重新解析
+(公众号 ArticleSpider.parse_page, 政府网站 parse_html), 不访问网络、不启动浏览器; 与库中不同的记录批量更新.
+浏览器渲染的页面保存时带有不可见标记(data-spider-hidden), html_visible 据此排除 CSS 隐藏的段落;
+更早保存的浏览器页面没有标记, 重新解析的 content 可能包含隐藏段落, 此时用 --fields 排除 content.
+python replay.py [--only=bjrs.zfgb,bjrs.fkzn] [--processes=4] [--limit=1000] [--dry-run] [--fields=title,page_source]
+"""
+import os
+import sys
+import time
+from pathlib import Path
+from multiprocessing import Pool
+
+sys.path.append(str(Path(__file__).absolute().parent / 'src'))
+
+import fire
+from loguru import logger
+from pyquery import PyQuery as Pq
+from sqlalchemy import select
+from plugins import load_spiders
+from spider_base import OUTPUT_PATH
+from utils.database import Database
+from utils.archive import read_record, is_archived
+from utils.tools import update_pages
+
+FIELDS = ('title', 'content', 'page_source', 'page_release_date')
+
+_specs = dict()
+_parsers = dict()
+_base = None
+
+
+def _init_worker(specs, base):
+    global _specs, _base
+    _specs, _base = specs, base
+
+
+def _parser(site):
+    """每个进程中每个站点只创建一个解析用的爬虫实例"""
+    if site not in _parsers:
+        kind, target = _specs[site]
+        if kind == 'browser':
+            _parsers[site] = target.offline()
+        else:
+            from src.api.article import ArticleSpider
+            _parsers[site] = ArticleSpider.offline(**target)
+    return _parsers[site]
+
+
+def load_html(base, record_path):
+    """
+    :param base: output 目录的上一级
+    :param record_path: 记录目录, 或归档中的 "<段文件>#<偏移>:<长度>"
+    :return:
+    """
+    if is_archived(record_path):
+        return read_record(base, record_path)[1].decode('utf-8')
+    record_dir = Path(base) / record_path
+    for path in sorted(record_dir.glob('*.html')):
+        with open(path, 'r', encoding='utf-8-sig') as f:
+            return f.read()
+    raise FileNotFoundError(f"no html in {record_dir}")
+
+
+def reparse(row):
+    """
+    :param row: (page_url, site, category, record_path, fields)
+    :return: (page_url, parsed, error)
+    """
+    page_url, site, category, record_path, fields = row
+    try:
+        html = load_html(_base, record_path)
+        parser = _parser(site)
+        if _specs[site][0] == 'browser':
+            record = parser.parse_html(Pq(html, parser='html'), page_url, category)
+            if hasattr(parser, 'img'):
+                parser.img.clear()
+        else:
+            record = parser.parse_page(html)
+    except Exception as e:
+        return page_url, None, f'{type(e).__name__}: {e}'
+    return page_url, {field: record.get(field) for field in fields}, None
+
+
+def changes(rows, outputs, stats, fields=FIELDS):
+    """
+    新解析结果与库中不同的记录; 解析结果为空的字段保留原值(公众号的发布时间来自接口, 不从页面解析)
+    :return: [{page_url, <fields>}]
+    """
+    updates = list()
+    for row, (page_url, parsed, error) in zip(rows, outputs):
+        stats['scanned'] += 1
+        if error:
+            stats['failed'] += 1
+            logger.warning(f"replay failed: {page_url}, {error}")
+            continue
+        old = {field: getattr(row, field) for field in fields}
+        new = {field: parsed.get(field) if parsed.get(field) not in (None, '') else old[field] for field in fields}
+        if new != old:
+            updates.append(dict(new, page_url=page_url))
+    stats['changed'] += len(updates)
+    return updates
+
+
+def parser_specs(spiders):
+    """站点名 -> 解析方式"""
+    specs = dict()
+    for entry in spiders.values():
+        if entry.kind == 'browser':
+            specs[entry.handler.offline().site] = ('browser', entry.handler)
+        else:
+            specs[entry.kwargs.get('site')] = ('article', {key: entry.kwargs.get(key)
+                                                           for key in ('province', 'city', 'site')})
+    return specs
+
+
+def main(only=None, processes=None, limit=None, batch_size=2000, dry_run=False, fields=FIELDS):
+    """
+    :param only: 只处理指定名称的爬虫, 逗号分隔
+    :param processes: 进程数, 默认 CPU 核数
+    :param limit: 最多处理的记录数
+    :param batch_size: 每批读取、解析、更新的记录数
+    :param dry_run: 只统计变化, 不更新数据库
+    :param fields: 重新解析并更新的字段, 逗号分隔, 默认 title,content,page_source,page_release_date
+    :return:
+    """
+    start_time = time.time()
+    spiders = load_spiders()
+    if only:
+        names = set(only.split(',') if isinstance(only, str) else only)
+        spiders = {name: entry for name, entry in spiders.items() if name in names}
+    specs = parser_specs(spiders)
+    fields = tuple(fields.split(',') if isinstance(fields, str) else fields)
+    unknown = set(fields) - set(FIELDS)
+    if unknown:
+        raise ValueError(f"fields must be among {FIELDS}: {sorted(unknown)}")
+    db = Database.shared()
+    table = db.table('data')
+    query = select(table.c.page_url, table.c.site, table.c.category, table.c.record_path,
+                   *(table.c[field] for field in fields)) \
+        .where(table.c.site.in_(list(specs)), table.c.record_path.isnot(None), table.c.record_path != '')
+    if limit:
+        query = query.limit(limit)
+
+    workers = processes or os.cpu_count() or 1
+    stats = {'scanned': 0, 'failed': 0, 'changed': 0, 'updated': 0}
+    logger.info(f"Replay sites: {list(specs)}, fields: {fields}, processes: {workers}, dry run: {dry_run}")
+    with Pool(workers, initializer=_init_worker, initargs=(specs, OUTPUT_PATH.parent)) as pool:
+        with db.engine.connect() as conn:
+            result = conn.execution_options(stream_results=True, yield_per=batch_size).execute(query)
+            for rows in result.partitions(batch_size):
+                outputs = pool.map(reparse, [(row.page_url, row.site, row.category, row.record_path, fields)
+                                             for row in rows], chunksize=max(len(rows) // (workers * 4), 1))
+                updates = changes(rows, outputs, stats, fields)
+                if updates and not dry_run:
+                    stats['updated'] += update_pages(db, table, updates, fields)
+                logger.info(f"Replay progress: {stats}")
+
+    logger.info("# Replay end: {}, consuming time: {:.2f}s".format(stats, time.time() - start_time))
+    return stats
+
+
+if __name__ == '__main__':
+    fire.Fire(main)
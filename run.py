@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+统一调度全部已注册的爬虫
+python run.py [--workers=10] [--browsers=1] [--only=bjrs.zfgb,article.MzA4NTIyMjMyMw==] [--profile] [--concurrency=4 ...]
+其余参数透传给浏览器爬虫的 start_request
+多节点: 任意一处 python run.py --jobs --enqueue 开始新一轮, 各节点 python run.py --jobs [--wait=60] 从任务表领取来源
+"""
+import sys
+import time
+import signal
+import threading
+import traceback
+from pathlib import Path
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.append(str(Path(__file__).absolute().parent / 'src'))
+
+import fire
+from loguru import logger
+from plugins import load_spiders
+from utils.database import Database
+from utils.browser import BrowserManager
+from utils.metrics import metrics
+from utils.jobs import JobQueue
+from spider_base import LOG_PATH
+
+SHUTDOWN = threading.Event()
+
+
+def run_session(entry, profile=False):
+    """普通 HTTP 任务(公众号 task)"""
+    if SHUTDOWN.is_set():
+        logger.info(f"System signal to exit: [{entry.title}]")
+        return
+    return entry.handler(profile=profile, **entry.kwargs)
+
+
+def run_browser(p, manager, entry, headless=True, profile=False, **options):
+    """
+    在通道的浏览器中运行一个浏览器爬虫
+    :return: start_request 报告成功时为 True; 爬虫在 start_request 内部捕获的错误与写入失败均为 False
+    """
+    logger.info(f"[{entry.title}] into execution")
+    spider = None
+    try:
+        spider = entry.handler(p, headless=headless, browser_manager=manager, **entry.kwargs)
+        ok = spider.run(profile=profile, **options) is True
+        if ok:
+            logger.info(f"Execution completed: [{entry.title}]")
+        else:
+            logger.error(f"Execution failed: [{entry.title}]")
+        return ok
+    except Exception:
+        logger.error(f"An error occurred! \nTrigger: {entry.title} \nError: {traceback.format_exc()}")
+        if spider is not None:
+            spider.close()
+    return False
+
+
+def run_browser_lane(entries, headless=True, profile=False, **options):
+    """
+    一个浏览器通道: 一个 playwright 实例与一个 firefox 进程, 依次运行分配到的浏览器爬虫, 每个爬虫使用独立的上下文
+    :param entries:
+    :param headless:
+    :param profile: 记录每个爬虫的 cProfile 与 tracemalloc
+    :param options: 透传给 start_request
+    :return:
+    """
+    from playwright.sync_api import sync_playwright
+    with sync_playwright() as p:
+        manager = BrowserManager(p, headless=headless)
+        try:
+            for entry in entries:
+                if SHUTDOWN.is_set():
+                    logger.info(f"System signal to exit: [{entry.title}]")
+                    return
+                run_browser(p, manager, entry, headless, profile, **options)
+        finally:
+            manager.close()
+
+
+def run_browser_jobs(queue, spiders, headless=True, profile=False, wait=0, **options):
+    """浏览器通道的任务表模式: 从任务表领取浏览器爬虫, 直到没有可领取的任务"""
+    from playwright.sync_api import sync_playwright
+    with sync_playwright() as p:
+        manager = BrowserManager(p, headless=headless)
+        try:
+            queue.work(lambda job: run_browser(p, manager, spiders[job.name], headless, profile, **options),
+                       kinds=('browser',), names=list(spiders), stop=SHUTDOWN, wait=wait)
+        finally:
+            manager.close()
+
+
+def run_jobs(spiders, workers=10, browsers=1, headless=True, profile=False, enqueue=False, wait=0, **options):
+    """
+    任务表模式, 多个进程或节点共享 public.crawl_job 中的来源
+    :param spiders: 本进程可执行的来源
+    :param workers: 领取公众号任务的线程数
+    :param browsers: 领取浏览器爬虫任务的通道数
+    :param headless:
+    :param profile:
+    :param enqueue: 先把来源重置为 pending, 开始新一轮
+    :param wait: 没有可领取的任务时每隔 wait 秒重试, 0 时领取完即退出
+    :param options:
+    :return:
+    """
+    queue = JobQueue(Database.shared())
+    queue.ensure()
+    if enqueue:
+        logger.info(f"Jobs enqueued: {queue.enqueue(spiders.values())}")
+    kinds = {entry.kind for entry in spiders.values()}
+    session_workers = workers if 'session' in kinds else 0
+    lanes = browsers if 'browser' in kinds else 0
+    logger.info(f"Job worker start up: {queue.owner}, session workers: {session_workers}, browser lanes: {lanes}")
+
+    threads = [threading.Thread(target=run_browser_jobs, args=(queue, spiders, headless, profile, wait),
+                                kwargs=options, daemon=True) for _ in range(lanes)]
+    for thread in threads:
+        thread.start()
+    with ThreadPoolExecutor(max_workers=max(session_workers, 1)) as thread_pool:
+        futures = [thread_pool.submit(queue.work, lambda job: run_session(spiders[job.name], profile),
+                                      kinds=('session',), names=list(spiders), stop=SHUTDOWN, wait=wait)
+                   for _ in range(session_workers)]
+    for future in futures:
+        if future.exception():
+            logger.error(f"Job worker stopped: {future.exception()!r}")
+    for thread in threads:
+        thread.join()
+    logger.info(f"Jobs: {queue.summary(list(spiders))}")
+
+
+def run_all(spiders, workers=10, browsers=1, headless=True, profile=False, **options):
+    """本进程运行全部来源: 公众号任务进线程池, 浏览器爬虫按通道分配"""
+    sessions = [entry for entry in spiders.values() if entry.kind == 'session']
+    browser_entries = [entry for entry in spiders.values() if entry.kind == 'browser']
+    lanes = [browser_entries[i::browsers] for i in range(browsers)] if browsers else []
+    lanes = [lane for lane in lanes if lane]
+
+    Database.configure(pool_size=workers + len(lanes))
+    logger.info(f"Runner start up: {len(sessions)} session tasks (workers: {workers}), "
+                f"{len(browser_entries)} browser spiders (lanes: {len(lanes)})")
+
+    threads = [threading.Thread(target=run_browser_lane, args=(lane, headless, profile), kwargs=options,
+                                daemon=True) for lane in lanes]
+    for thread in threads:
+        thread.start()
+    with ThreadPoolExecutor(max_workers=workers) as thread_pool:
+        for entry in sessions:
+            thread_pool.submit(run_session, entry, profile)
+    for thread in threads:
+        thread.join()
+
+
+def signal_handler(_signo, _stack_frame):
+    logger.info(f'Process _signo: {_signo}, system try to stop and exit')
+    SHUTDOWN.set()
+    import src.api.article as article
+    article.signal_handler(_signo, _stack_frame)
+
+
+def main(workers=10, browsers=1, only=None, headless=True, profile=False, jobs=False, enqueue=False, wait=0,
+         **options):
+    """
+    :param workers: 普通 HTTP 任务(公众号)的并发数
+    :param browsers: 浏览器通道数, 每个通道一个浏览器进程, 通道内的爬虫依次运行并复用浏览器上下文
+    :param only: 只运行指定名称的爬虫, 逗号分隔
+    :param headless:
+    :param profile: 每个来源记录 cProfile 与 tracemalloc, 写入 src/log/profile
+    :param jobs: 任务表模式, 从 public.crawl_job 领取来源, 可在多个进程或节点同时运行
+    :param enqueue: 任务表模式下先开始新一轮
+    :param wait: 任务表模式下没有可领取的任务时每隔 wait 秒重试, 0 时领取完即退出
+    :param options: 透传给浏览器爬虫 start_request 的参数, 如 --concurrency --fetch --full
+    :return:
+    """
+    signal.signal(signal.SIGTERM, signal_handler)
+    signal.signal(signal.SIGINT, signal_handler)
+    start_time = time.time()
+
+    spiders = load_spiders()
+    if only:
+        names = set(only.split(',') if isinstance(only, str) else only)
+        spiders = {name: entry for name, entry in spiders.items() if name in names}
+    if jobs:
+        Database.configure(pool_size=workers + browsers * 2)
+        run_jobs(spiders, workers, browsers, headless, profile, enqueue, wait, **options)
+    else:
+        run_all(spiders, workers, browsers, headless, profile, **options)
+
+    metrics.write(LOG_PATH)
+    logger.info("# End at {}, consuming time: {:.2f}s, process exit.".format(
+        datetime.now().strftime("%Y-%m-%d %H:%M:%S"), time.time() - start_time))
+
+
+if __name__ == '__main__':
+    fire.Fire(main)
@@ -1,19 +1,23 @@
 import sys
+import asyncio
 # from pathlib import Path
 import re
 import time
 import traceback
 import urllib3
 import signal
-import dateparser
 from pyquery import PyQuery as Pq
 from datetime import datetime
 from concurrent.futures import ThreadPoolExecutor
 from loguru import logger
-from utils.settings import DATETIME_REGEXES
-from src.spider_base import SessionBase
-from utils.tools import gen_invalid_record, duplicate_filter, convert_to_relative_path, save_page, \
-    generate_path, downloader
+from utils.date_extract import extract_datetime
+from src.spider_base import SessionBase, LOG_PATH
+from utils.database import Database
+from plugins import register
+from utils.async_fetch import AsyncFetcher
+from utils.metrics import metrics
+from utils.profiling import profiled
+from utils.tools import gen_invalid_record, convert_to_relative_path, download_batch
 
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 
@@ -167,9 +171,18 @@ DELAY_ONLINE = {
 class ArticleSpider(SessionBase):
     def __init__(self, biz: str = None, base_type: int = None, **kwargs):
         super().__init__(biz=biz, base_type=base_type, **kwargs)
-        self.province = kwargs.get("province")
-        self.city = kwargs.get("city")
-        self.site = kwargs.get("site")
+        self.__site_init__(**kwargs)
+        self.async_mode = kwargs.get("async_mode", False)
+        self.per_host = kwargs.get("per_host") or 4
+        since = kwargs.get("since")
+        self.since = datetime.strptime(str(since), "%Y-%m-%d") if since else None
+        self.max_pages = kwargs.get("max_pages") or None
+
+    def __site_init__(self, province=None, city=None, site=None, **kwargs):
+        """公众号配置"""
+        self.province = province
+        self.city = city
+        self.site = site
         self.categories = '公众号'
         self.page_record = {
             'province': self.province,
@@ -187,54 +200,162 @@ class ArticleSpider(SessionBase):
             'created_time': None
         }
 
+    @classmethod
+    def offline(cls, **kwargs):
+        """不连接数据库的实例, 只用于解析保存的页面(parse_page)"""
+        spider = cls.__new__(cls)
+        spider.__site_init__(**kwargs)
+        return spider
+
     def start_request(self):
+        if self.async_mode:
+            return asyncio.run(self.start_request_async())
+
+        category_path = self.output_path.joinpath(self.site, self.categories)
+        if not category_path.exists():
+            category_path.mkdir(parents=True)
+
+        try:
+            for article in self.articles():
+                link = article.get('link')
+                logger.info(f"title: {article.get('title')}, link: {article.get('link')}")
+
+                with self.timer('detail_http'):
+                    resp = self.link_session.get(url=link, verify=False, timeout=3)
+                if resp.status_code != 200:
+                    logger.info(f"link failed: {link}")
+                    self.write_records([gen_invalid_record(self.page_record, self.categories, link)])
+                    self.count('invalid')
+                    self.seen_urls.add(link)
+                    continue
+
+                record, attachment_path = self.build_record(article, resp.text, category_path)
+                with self.timer('download'):
+                    record['attachment_name'] = self.download_attachments(resp.text, attachment_path)
+                self.write_records([record])
+                self.count('fetched')
+                self.seen_urls.add(link)
+        finally:
+            # 已抓取的记录在出错时同样写入
+            ok = self.flush_records()
+        if ok and self.since is None:
+            self.commit_source()
+
+    async def start_request_async(self):
+        """
+        asyncio 模式: 当日全部文章页面及其图片并发抓取, 每个 host 的并发数由 per_host 限制,
+        产出的 page_record 与文件与同步模式一致
+        """
         category_path = self.output_path.joinpath(self.site, self.categories)
         if not category_path.exists():
             category_path.mkdir(parents=True)
 
-        articles = self.get_article()
+        articles = list(self.articles())
+        with AsyncFetcher(session=self.link_session, per_host=self.per_host, store=self.blob_store) as fetcher:
+            results = await asyncio.gather(
+                *(self._fetch_article(fetcher, article, category_path) for article in articles),
+                return_exceptions=True
+            )
+        # 与同步模式一致: 已抓取的记录照常写入, 有文章请求出错时抛出, 不提交列表校验值, 下次运行重新抓取
+        self.write_records([record for record in results if record and not isinstance(record, Exception)])
+        ok = self.flush_records()
+        errors = [result for result in results if isinstance(result, Exception)]
+        if errors:
+            raise errors[0]
+        if ok and self.since is None:
+            self.commit_source()
+
+    async def _fetch_article(self, fetcher, article, category_path):
+        link = article.get('link')
+        logger.info(f"title: {article.get('title')}, link: {link}")
+        try:
+            with self.timer('detail_http'):
+                resp = await fetcher.get(link, verify=False, timeout=3)
+        except Exception:
+            logger.warning(f"link failed: {link}\n{traceback.format_exc()}")
+            raise
+        if resp.status_code != 200:
+            logger.info(f"link failed: {link}")
+            self.count('invalid')
+            self.seen_urls.add(link)
+            return gen_invalid_record(self.page_record, self.categories, link)
+
+        record, attachment_path = self.build_record(article, resp.text, category_path)
+        targets = self.attachment_targets(resp.text, attachment_path)
+        if targets:
+            attachment_path.mkdir(parents=True, exist_ok=True)
+        with self.timer('download'):
+            results = await asyncio.gather(
+                *(fetcher.download(url, download_path) for url, filename, download_path in targets),
+                return_exceptions=True
+            )
+        record['attachment_name'] = ', '.join(
+            filename for (url, filename, download_path), result in zip(targets, results)
+            if not isinstance(result, Exception)
+        )
+        self.count('fetched')
+        self.seen_urls.add(link)
+        return record
+
+    def articles(self):
+        """
+        待抓取的文章: 默认只取第一页中当日发布的文章;
+        配置了 since 时逐页回溯到该日期或已入库的文章为止, 边翻页边抓取
+        :return:
+        """
+        if self.since is None:
+            return self.fresh_articles(self.get_article())
+        logger.info(f"[{self.site}] backfill since {self.since:%Y-%m-%d}")
+        return self.iter_articles(since=self.since, max_pages=self.max_pages)
+
+    def fresh_articles(self, articles):
+        """
+        筛选当日发布且未入库的文章
+        :param articles:
+        :return:
+        """
         logger.info(f"Get articles: {len(articles)}")
-        page_records = list()
+        fresh = list()
+        today = datetime.now().strftime("%Y-%m-%d 00:00:00")
+        self.seen_urls.confirm([article.get('link') for article in articles])
         for article in articles:
             link = article.get('link')
             title = article.get('title')
-            today = datetime.now().strftime("%Y-%m-%d 00:00:00")
             release_time = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(article.get("create_time")))
             if release_time < today:
                 logger.info(f"Posted in the past: [{title}]\t*{release_time}*")
                 continue
-            if duplicate_filter(self.db, self.page_table, link):
+            if link in self.seen_urls:
                 logger.info(f"Duplicate link: {link}, pass")
+                self.count('duplicate')
                 continue
-            logger.info(f"title: {article.get('title')}, link: {article.get('link')}")
+            fresh.append(article)
+        return fresh
 
-            resp = self.link_session.get(url=link, verify=False, timeout=3)
-            if resp.status_code != 200:
-                logger.info(f"link failed: {link}")
-                page_records.append(gen_invalid_record(self.page_record, self.categories, link))
-                continue
-            text = resp.text
-
-            basename = re.search(r"sn=.*&", link).group().replace("=", "").replace("&", "")
-            record_path, attachment_path = generate_path(category_path, basename)
-            with open(record_path.joinpath(f'{title}.html'), 'w', encoding='utf-8-sig') as f:
-                f.write(text)
-
-            record = self.parse_page(resp.text)
-            attachment_name = self.download_attachments(resp.text, attachment_path)
-            for regex in DATETIME_REGEXES:
-                result = re.search(regex, release_time)
-                if result:
-                    record['page_release_date'] = dateparser.parse(result.group(1))
-                    break
-            record["page_url"] = link
-            record["category"] = self.categories
-            record['record_path'] = convert_to_relative_path(record_path)
-            record['attachment_name'] = attachment_name
-            record['attachment_path'] = convert_to_relative_path(attachment_path)
-            page_records.append(record)
-        if page_records:
-            save_page(self.db, self.page_table, page_records)
+    def build_record(self, article, text, category_path):
+        """
+        保存页面并解析为 page_record(不含附件)
+        :param article:
+        :param text:
+        :param category_path:
+        :return: page_record, attachment_path
+        """
+        link = article.get('link')
+        title = article.get('title')
+        release_time = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(article.get("create_time")))
+
+        basename = re.search(r"sn=.*&", link).group().replace("=", "").replace("&", "")
+        record_path = self.store_page(category_path, basename, link, text, filename=f'{title}.html')
+        attachment_path = self.attachment_dir(category_path, basename, create=False)
+
+        with self.timer('parse'):
+            record = self.parse_page(text)
+        record['page_release_date'] = extract_datetime(release_time)
+        record["page_url"] = link
+        record["category"] = self.categories
+        record['record_path'] = record_path
+        record['attachment_path'] = convert_to_relative_path(attachment_path)
+        return record, attachment_path
 
     def parse_page(self, text) -> dict:
         page_record = self.page_record.copy()
@@ -250,11 +371,15 @@ class ArticleSpider(SessionBase):
         return page_record
 
     @staticmethod
-    def download_attachments(text, attachment_path):
+    def attachment_targets(text, attachment_path):
+        """
+        页面中需要下载的附件
+        :return: [(url, filename, download_path)]
+        """
         doc = Pq(text)
         attachments = doc("div#img-content div#js_content img")
         idx = 0
-        attachment_name = list()
+        targets = list()
         for attachment in attachments.items():
             url = attachment.attr("data-src")
             extension = attachment.attr("data-type")
@@ -262,20 +387,23 @@ class ArticleSpider(SessionBase):
                                    '.webp', '.bmp', '.zip', '.rar', '.7z']:
                 idx += 1
                 filename = f"img_{idx}." + extension
-                download_path = attachment_path.joinpath(filename)
-                try:
-                    downloader(url, download_path)
-                except Exception as e:
-                    pass
-                else:
-                    attachment_name.append(filename)
-        return ', '.join(attachment_name)
+                targets.append((url, filename, attachment_path.joinpath(filename)))
+        return targets
+
+    def download_attachments(self, text, attachment_path):
+        targets = self.attachment_targets(text, attachment_path)
+        if targets:
+            attachment_path.mkdir(parents=True, exist_ok=True)
+        results = download_batch([(url, download_path) for url, filename, download_path in targets],
+                                 store=self.blob_store)
+        return ', '.join(filename for (url, filename, download_path), ok in zip(targets, results) if ok)
 
 
-def task(__biz: str = None, **kwargs):
+def task(__biz: str = None, profile: bool = False, **kwargs):
     """
     任务
     :param __biz:
+    :param profile: 记录 cProfile 与 tracemalloc, 写入 log/profile/article_<site>_<biz>.*
     :param kwargs:
     :return:
     """
@@ -298,7 +426,8 @@ def task(__biz: str = None, **kwargs):
             "biz": __biz
         })
         spider = ArticleSpider(**config.get("subscription"), **kwargs)
-        spider.start_request()
+        with spider.log_context(), profiled(f"article_{site}_{__biz}", LOG_PATH, enabled=profile):
+            spider.start_request()
         logger.info(f"Execution completed: [{province}/{city} - {site}]")
         return True
     except Exception as e:
@@ -318,6 +447,10 @@ def signal_handler(_signo, _stack_frame):
     SHUTDOWN_FLAG = True
 
 
+for _biz, _one in __BIZ.items():
+    register(f"article.{_biz}", 'session', task, title=_one.get('site'), __biz=_biz, **_one)
+
+
 if __name__ == '__main__':
     signal.signal(signal.SIGTERM, signal_handler)
     signal.signal(signal.SIGINT, signal_handler)
@@ -329,15 +462,18 @@ if __name__ == '__main__':
         thread_amounts = int(sys.argv[1])
     except Exception as exc:
         thread_amounts = 10
+    profile = '--profile' in sys.argv
 
+    Database.configure(pool_size=thread_amounts)
     logger.info(f"{visualize_time}")
     logger.info(f"(Subscription) Spider script will start up, ThreadPoolExecutor: [{thread_amounts}]")
     thread_pool = ThreadPoolExecutor(max_workers=thread_amounts)
 
     for _biz, one in __BIZ.items():
-        thread_pool.submit(task, __biz=_biz, **one)
+        thread_pool.submit(task, __biz=_biz, profile=profile, **one)
         break
 
     thread_pool.shutdown()
+    metrics.write(LOG_PATH)
     logger.info("# End at {}, consuming time: {:.2f}s, process exit.".format(
         datetime.now().strftime("%Y-%m-%d %H:%M:%S"), time.time() - start_time))
\ No newline at end of file
@@ -1,34 +1,543 @@
 import requests
 import urllib3
+import traceback
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
+from datetime import datetime
+from urllib.parse import urljoin, urlparse
 from loguru import logger
-from utils.settings import FILE_SAVE_PATH
+from pyquery import PyQuery as Pq
+from utils.settings import FILE_SAVE_PATH, DETAIL_CONCURRENCY, FETCH_MODE, SCREENSHOT, SCREENSHOT_TYPE, \
+    SCREENSHOT_QUALITY, EXTRACT_MODE, STOP_AFTER_KNOWN, ARCHIVE_MODE
 from utils.database import Database
-from utils.tools import load_yaml
+from utils.blob_store import get_blob_store
+from utils.archive import get_archive, read_record, is_archived
+from utils.http_cache import get_validator_cache
+from utils.crawl_state import CrawlState
+from utils.metrics import metrics
+from utils.profiling import profiled
+from utils.record_writer import RecordWriter
+from utils.ratelimit import get_limiter, get_quota, credential_key, single_flight
+from utils.browser import BrowserManager, DetailPagePool, ResourcePolicy, ScreenshotPolicy, MARK_HIDDEN_SCRIPT, \
+    with_base
+from utils.tools import load_yaml, get_seen_index, generate_path, convert_to_relative_path, gen_invalid_record, \
+    download_batch, save_page, DOWNLOAD_HEADERS
 
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 
+LOG_PATH = Path(__file__).absolute().parent / 'log'
+OUTPUT_PATH = Path(FILE_SAVE_PATH) / 'output' if FILE_SAVE_PATH else Path(__file__).absolute().parent / 'output'
+
+_log_sinks = set()
+_log_sinks_lock = threading.Lock()
+
+
+def add_log_sink(path, name):
+    """
+    每个爬虫类的日志文件在进程内只添加一次(loguru 的 sink 是进程级的)
+    爬虫运行期间(log_context)的日志只写入该爬虫的文件, 没有爬虫上下文的日志(如详情页线程池中的)写入全部文件
+    :param path:
+    :param name: 爬虫类名
+    :return:
+    """
+    with _log_sinks_lock:
+        if path in _log_sinks:
+            return
+        logger.add(path, filter=lambda record: record["extra"].get("spider", name) == name)
+        _log_sinks.add(path)
+
 
 class SpiderBase:
     def __init__(self):
         """日志、数据库、文件路径配置"""
-        self.db = Database()
-        self.page_table = self.db.metadata.tables['public.data']
+        self.db = Database.shared()
+        self.page_table = self.db.table('data')
         # self.page_table = self.db.metadata.tables['public.data-new']
-        if FILE_SAVE_PATH:
-            self.output_path = Path(FILE_SAVE_PATH) / 'output'
-        else:
-            self.output_path = Path(__file__).absolute().parent / 'output'
+        self.output_path = OUTPUT_PATH
 
-        self.log_path = Path(__file__).absolute().parent / 'log'
+        self.blob_store = get_blob_store(self.output_path / '.blobs')
+        self.http_cache = get_validator_cache(self.output_path / '.http_cache.json')
+        self.archive = get_archive(self.output_path) if ARCHIVE_MODE else None
+
+        self.log_path = LOG_PATH
         if not self.log_path.exists():
             self.log_path.mkdir()
-        logger.add(self.log_path / f'{self.__class__.__name__}.log')
+        add_log_sink(self.log_path / f'{self.__class__.__name__}.log', self.__class__.__name__)
+        self._seen_urls = None
+        self._writer = None
+
+    @property
+    def seen_urls(self):
+        """已入库 link 索引, 首次使用时加载, 进程内各爬虫共享"""
+        if self._seen_urls is None:
+            self._seen_urls = get_seen_index(self.db, self.page_table)
+        return self._seen_urls
+
+    def store_page(self, category_path, basename, url, html, filename=None):
+        """
+        保存页面 HTML
+        :param category_path:
+        :param basename: 记录目录名
+        :param url:
+        :param html:
+        :param filename: 默认 <basename>.html
+        :return: record_path, 归档模式下为 "<段文件>#<偏移>:<长度>"
+        """
+        filename = filename or f'{basename}.html'
+        if self.archive is not None:
+            return self.archive.append(category_path, url, html, name=filename)
+        record_path, attachment_path = generate_path(category_path, basename)
+        with open(record_path.joinpath(filename), 'w', encoding='utf-8-sig') as f:
+            f.write(html)
+        return convert_to_relative_path(record_path)
+
+    def load_page(self, record_path, filename):
+        """读取 store_page 保存的页面"""
+        if is_archived(record_path):
+            return read_record(self.output_path.parent, record_path)[1].decode('utf-8')
+        with open(self.output_path.parent / record_path / filename, 'r', encoding='utf-8-sig') as f:
+            return f.read()
+
+    def attachment_dir(self, category_path, basename, create=True):
+        """
+        附件目录
+        :param create: 归档模式下只在有附件时创建
+        :return:
+        """
+        if self.archive is None:
+            return generate_path(category_path, basename)[1]
+        attachment_path = category_path.joinpath(basename, 'attachment')
+        if create:
+            attachment_path.mkdir(parents=True, exist_ok=True)
+        return attachment_path
+
+    @property
+    def metric_labels(self):
+        return {'site': getattr(self, 'site', None) or self.__class__.__name__, 'biz': getattr(self, 'biz', None)}
+
+    def log_context(self):
+        """运行期间的日志只写入本爬虫的日志文件"""
+        return logger.contextualize(spider=self.__class__.__name__)
+
+    def timer(self, stage):
+        """记录阶段耗时"""
+        return metrics.timer('spider_stage_seconds', stage=stage, **self.metric_labels)
+
+    def count(self, status, value=1):
+        """记录条数: fetched、duplicate、invalid、stored、conflict"""
+        metrics.inc('spider_records_total', value, status=status, **self.metric_labels)
+
+    def save_records(self, page_records):
+        """
+        入库并记录耗时与条数
+        :param page_records:
+        :return: (inserted, skipped)
+        """
+        if not page_records:
+            return 0, 0
+        with self.timer('save_page'):
+            inserted, skipped = save_page(self.db, self.page_table, page_records)
+        self.count('stored', inserted)
+        self.count('conflict', skipped)
+        return inserted, skipped
+
+    @property
+    def writer(self):
+        """后台入库线程, 首次写入时启动"""
+        if self._writer is None:
+            self._writer = RecordWriter(self.save_records, name=f'{self.__class__.__name__}-writer')
+        return self._writer
+
+    def write_records(self, page_records):
+        """
+        交给后台入库线程写入, 写入跟不上时阻塞; 同时更新增量爬取状态(运行成功结束后才保存)
+        :param page_records:
+        :return:
+        """
+        self.writer.put_many(page_records)
+        if getattr(self, 'state', None) is not None:
+            self.state.update(page_records)
+
+    def flush_records(self):
+        """
+        等待后台入库线程写完并结束
+        :return: 全部记录是否写入成功, 失败时不应保存增量状态与校验值
+        """
+        if self._writer is None:
+            return True
+        writer, self._writer = self._writer, None
+        ok = writer.close()
+        if not ok:
+            logger.error(f"{writer.failed} records failed to save")
+        return ok
 
     def start_request(self):
         raise NotImplementedError
 
 
+class BrowserBase(SpiderBase):
+    """
+    政府网站爬虫基类
+    fetch='http' 时列表页、详情页直接通过 HTTP 获取并用 pyquery 解析,
+    页面缺少内容(需要渲染)、请求失败或需要截图时才使用 playwright(firefox);
+    fetch='browser' 时全部页面由浏览器加载.
+    子类提供 list_selector、detail_selector(详情页就绪标志)、content_selector(正文段落),
+    浏览器解析 parse_page/download_attachments 与 HTML 解析 parse_html/html_attachments
+    """
+    list_selector = None
+    detail_selector = None
+    content_selector = None
+    resource_policy = dict()
+
+    def __init__(self, playwright, headless=None, browser_manager=None):
+        super(BrowserBase, self).__init__()
+        """
+        日志、浏览器配置, 浏览器在首次使用时启动
+        :param browser_manager: 多个爬虫共享的 BrowserManager, 未指定时爬虫单独使用一个浏览器
+        """
+        self.playwright = playwright
+        self.headless = headless
+        self.own_manager = browser_manager is None
+        self.browser_manager = browser_manager or BrowserManager(playwright, headless=headless)
+        self._context = None
+        self.session = requests.session()
+        self.session.headers.update(DOWNLOAD_HEADERS)
+        self.policy = ResourcePolicy(**self.resource_policy)
+        self.extract = EXTRACT_MODE
+        self.full = False
+        self.stop_after = STOP_AFTER_KNOWN
+        self.consecutive_known = 0
+        self.state = None
+        self.pending_screenshots = []
+        self.screenshot = SCREENSHOT
+
+    def __site_init__(self):
+        """网站栏目配置: province、city、site、origin、categories、page_record"""
+        raise NotImplementedError
+
+    @classmethod
+    def offline(cls):
+        """不连接数据库、不启动浏览器的实例, 只用于解析保存的 HTML(parse_html)"""
+        spider = cls.__new__(cls)
+        spider.__site_init__()
+        return spider
+
+    @property
+    def screenshot(self):
+        return self._screenshot
+
+    @screenshot.setter
+    def screenshot(self, value):
+        """
+        截图策略: off / viewport / full(兼容 True / False), 也可直接传入 ScreenshotPolicy
+        截图在抓取结束后补拍, 抓取时浏览器始终不加载图片
+        """
+        if not isinstance(value, ScreenshotPolicy):
+            value = ScreenshotPolicy(value, image_type=SCREENSHOT_TYPE, quality=SCREENSHOT_QUALITY)
+        self._screenshot = value
+        self.policy.block_images = True
+
+    @property
+    def browser(self):
+        return self.browser_manager.browser
+
+    @property
+    def context(self):
+        """从 BrowserManager 取得本爬虫的浏览器上下文并安装请求拦截"""
+        if self._context is None:
+            self._context = self.browser_manager.acquire()
+            self.policy.install(self._context)
+        return self._context
+
+    def close(self):
+        """写完剩余记录, 补拍延后的截图, 归还浏览器上下文, 浏览器不是共享的时一并关闭"""
+        self.flush_records()
+        self.take_screenshots()
+        if self._context is not None:
+            logger.info(f"Blocked requests: {self.policy.total['blocked']} {dict(self.policy.total['blocked_types'])}, "
+                        f"allowed: {self.policy.total['allowed']}")
+            self.policy.uninstall(self._context)
+            self.browser_manager.release(self._context)
+            self._context = None
+        if self.own_manager:
+            self.browser_manager.close()
+
+    def start_request(self, concurrency=DETAIL_CONCURRENCY, fetch=FETCH_MODE, screenshot=SCREENSHOT,
+                      extract=EXTRACT_MODE, full=False, stop_after=STOP_AFTER_KNOWN):
+        raise NotImplementedError
+
+    def run(self, profile=False, **options):
+        """
+        start_request 的入口
+        :param profile: 记录 cProfile 与 tracemalloc, 写入 log/profile/<类名>.*
+        :param options: 透传给 start_request
+        :return: start_request 的结果, 成功时为 True
+        """
+        with self.log_context(), profiled(self.__class__.__name__, self.log_path, enabled=profile):
+            return self.start_request(**options)
+
+    def load_state(self, category, full=False, stop_after=STOP_AFTER_KNOWN):
+        """
+        加载栏目的增量爬取状态
+        :param category:
+        :param full: 全量回溯, 不因连续的已入库链接停止翻页
+        :param stop_after: 连续遇到多少个已入库链接后停止
+        :return:
+        """
+        self.full = full
+        self.stop_after = stop_after
+        self.consecutive_known = 0
+        self.state = CrawlState(self.output_path / '.crawl_state', self.site, category)
+        return self.state
+
+    @property
+    def stop_reached(self):
+        """增量模式下已连续遇到 stop_after 个已入库链接, 之后的列表均为旧内容"""
+        return not self.full and bool(self.stop_after) and self.consecutive_known >= self.stop_after
+
+    def fetch_html(self, url, stage='detail_http'):
+        """
+        HTTP 获取页面
+        :param url:
+        :param stage: 耗时记录的阶段, 列表页为 list
+        :return: 页面 HTML, 失败时返回 None
+        """
+        try:
+            with self.timer(stage):
+                resp = self.session.get(url, verify=False, timeout=10)
+            resp.raise_for_status()
+        except Exception:
+            logger.warning(f"http fetch failed: {url}")
+            return None
+        return self.decode(resp)
+
+    @staticmethod
+    def decode(resp):
+        if not resp.encoding or resp.encoding.lower() == 'iso-8859-1':
+            resp.encoding = resp.apparent_encoding
+        return resp.text
+
+    def origin_changed(self, url):
+        """
+        条件请求列表首页, 判断自上次成功运行以来是否有变化
+        :param url:
+        :return: (changed, html), 未变化或请求失败时 html 为 None
+        """
+        try:
+            with self.timer('list'):
+                resp, changed = self.http_cache.get(self.session, url, verify=False, timeout=10)
+        except Exception:
+            logger.warning(f"http fetch failed: {url}")
+            return True, None
+        if not changed:
+            logger.info(f"List page unchanged since last run, pass: {url}")
+            return False, None
+        return True, self.decode(resp)
+
+    def html_links(self, html):
+        """HTTP 获取的列表页中的详情链接"""
+        if not html:
+            return []
+        doc = Pq(html, parser='html')
+        return [a.get('href') for a in doc(self.list_selector) if a.get('href')]
+
+    def crawl_links(self, base_url, hrefs, category, category_path, concurrency=DETAIL_CONCURRENCY, fetch=FETCH_MODE):
+        """
+        处理列表页上的详情链接: 判重, 并发获取详情页并保存解析
+        :param base_url: 列表页地址
+        :param hrefs: 列表页上的详情链接
+        :param category:
+        :param category_path:
+        :param concurrency: 同时获取的详情页数量
+        :param fetch: http / browser
+        :return: page_records
+        """
+        page_records = []
+        targets = []
+        self.seen_urls.confirm(hrefs)
+        for href in hrefs:
+            if self.stop_reached:
+                logger.info(f"{self.consecutive_known} consecutive known links, stop")
+                break
+            detail_page_url = href
+            if detail_page_url in self.seen_urls:
+                logger.info(f"Duplicate link: {detail_page_url}")
+                self.count('duplicate')
+                self.consecutive_known += 1
+                continue
+            self.consecutive_known = 0
+            if Path(href).suffix != '.html':
+                page_records.append(gen_invalid_record(self.page_record, category, detail_page_url))
+                self.count('invalid')
+                self.seen_urls.add(detail_page_url)
+                continue
+            targets.append((href, urljoin(base_url, href)))
+
+        browser_targets = targets
+        if fetch == 'http' and targets:
+            browser_targets = []
+            with ThreadPoolExecutor(max_workers=max(int(concurrency), 1)) as executor:
+                htmls = list(executor.map(self.fetch_html, [url for href, url in targets]))
+            for (href, url), html in zip(targets, htmls):
+                page_record = self.process_html(url, href, html, category, category_path)
+                if page_record is None:
+                    logger.info(f"Fallback to browser: {url}")
+                    browser_targets.append((href, url))
+                    continue
+                logger.info(href)
+                page_records.append(page_record)
+                self.count('fetched')
+                self.seen_urls.add(href)
+                self.defer_screenshot(page_record, href, category_path)
+
+        if browser_targets:
+            pool = DetailPagePool(self.context, size=concurrency, ready_selector=self.detail_selector,
+                                  timer=lambda: self.timer('detail_browser'))
+            for href, detail_page in pool.map(browser_targets):
+                logger.info(href)
+                if detail_page is None:
+                    page_record = gen_invalid_record(self.page_record, category, href)
+                    self.count('invalid')
+                else:
+                    page_record = self.process_detail(detail_page, href, category, category_path)
+                    self.count('fetched')
+                    self.log_blocked(detail_page)
+                    self.defer_screenshot(page_record, href, category_path)
+                page_records.append(page_record)
+                self.seen_urls.add(href)
+        return page_records
+
+    def process_html(self, url, href, html, category, category_path):
+        """
+        保存并解析 HTTP 获取的详情页
+        :return: page_record, 页面缺少内容需要浏览器渲染时返回 None
+        """
+        if not html:
+            return None
+        doc = Pq(html, parser='html')
+        if self.detail_selector and not doc(self.detail_selector):
+            return None
+        try:
+            with self.timer('parse'):
+                page_record = self.parse_html(doc, url, category)
+        except Exception:
+            logger.warning(traceback.format_exc())
+            return None
+        return self.save_html_record(page_record, doc, html, url, href, category_path)
+
+    def save_html_record(self, page_record, doc, html, url, href, category_path):
+        """保存页面, 下载 html_attachments 中的附件, 补全 page_record"""
+        basename = Path(href).stem
+        page_record['record_path'] = self.store_page(category_path, basename, url, html)
+        targets = self.html_attachments(doc, url)
+        attachment_path = self.attachment_dir(category_path, basename, create=bool(targets))
+        with self.timer('download'):
+            results = download_batch([(attachment_url, attachment_path.joinpath(filename))
+                                      for attachment_url, filename in targets], store=self.blob_store)
+        attachment_name = ','.join(filename for (attachment_url, filename), ok in zip(targets, results) if ok)
+        if attachment_name:
+            page_record['attachment_name'] = attachment_name
+            page_record['attachment_path'] = convert_to_relative_path(attachment_path)
+        return page_record
+
+    def process_detail(self, detail_page, href, category, category_path):
+        """
+        保存浏览器加载的详情页, 解析并下载附件
+        extract='evaluate' 时一次 page.evaluate 取回(标记了不可见段落的)页面 HTML, 在本地用 parse_html 解析;
+        extract='dom' 时逐个元素查询(parse_page), 每次查询都是一次与浏览器的往返
+        两种方式保存的 HTML 都保留不可见标记, 离线重新解析(replay.py)时 html_visible 据此排除 CSS 隐藏的段落
+        :return: page_record
+        """
+        if self.extract == 'evaluate':
+            with self.timer('parse'):
+                html = detail_page.evaluate(MARK_HIDDEN_SCRIPT, self.content_selector)
+                doc = Pq(html, parser='html')
+                page_record = self.parse_html(doc, detail_page.url, category)
+            return self.save_html_record(page_record, doc, html, detail_page.url, href, category_path)
+
+        basename = Path(href).stem
+        html = detail_page.evaluate(MARK_HIDDEN_SCRIPT, self.content_selector)
+        record_path = self.store_page(category_path, basename, detail_page.url, html)
+        attachment_path = self.attachment_dir(category_path, basename)
+        with self.timer('parse'):
+            page_record = self.parse_page(detail_page, category)
+        page_record['record_path'] = record_path
+        with self.timer('download'):
+            attachment_name = self.download_attachments(detail_page, attachment_path)
+        if attachment_name:
+            page_record['attachment_name'] = attachment_name
+            page_record['attachment_path'] = convert_to_relative_path(attachment_path)
+        return page_record
+
+    def log_blocked(self, detail_page):
+        """记录页面被拦截的请求数"""
+        stats = self.policy.pop_stats(detail_page)
+        if stats:
+            logger.info(f"[{detail_page.url}] blocked: {stats['blocked']} {dict(stats['blocked_types'])}, "
+                        f"allowed: {stats['allowed']}")
+            for resource_type, blocked in stats['blocked_types'].items():
+                metrics.inc('spider_blocked_requests_total', blocked, type=resource_type, **self.metric_labels)
+
+    def defer_screenshot(self, page_record, href, category_path):
+        """记下需要截图的详情页, 在 take_screenshots 中补拍"""
+        if self.screenshot and page_record.get('record_path'):
+            self.pending_screenshots.append((page_record['page_url'], Path(href).stem, category_path,
+                                             page_record['record_path']))
+
+    def take_screenshots(self):
+        """
+        延后的截图: 抓取结束后在一个页面中依次用 set_content 渲染保存的 HTML 并截图, 不重新请求详情页,
+        也不占用抓取时间; 此时才允许加载图片
+        :return:
+        """
+        targets, self.pending_screenshots = self.pending_screenshots, []
+        if not targets:
+            return
+        logger.info(f"Screenshots ({self.screenshot.mode}): {len(targets)}")
+        self.policy.block_images = False
+        page = self.context.new_page()
+        try:
+            for url, basename, category_path, record_path in targets:
+                try:
+                    html = self.load_page(record_path, f'{basename}.html')
+                    page.set_content(with_base(html, url), wait_until='load')
+                    self.save_screenshot(page, url, category_path, basename)
+                except Exception:
+                    logger.warning(f"screenshot failed: {url}\n{traceback.format_exc()}")
+        finally:
+            page.close()
+            self.policy.block_images = True
+
+    def save_screenshot(self, page, url, category_path, basename):
+        """按截图策略截图, 归档模式下写入归档"""
+        with self.timer('screenshot'):
+            filename = f'{basename}{self.screenshot.suffix}'
+            if self.archive is not None:
+                self.archive.append(category_path, url, page.screenshot(**self.screenshot.options()),
+                                    content_type=self.screenshot.content_type, name=filename)
+                return
+            record_path, attachment_path = generate_path(category_path, basename)
+            page.screenshot(path=record_path.joinpath(filename), **self.screenshot.options())
+
+    def parse_page(self, page, category):
+        raise NotImplementedError
+
+    def parse_html(self, doc, url, category):
+        raise NotImplementedError
+
+    def download_attachments(self, page, save_path):
+        """页面附件, 无附件的栏目不需要实现"""
+        return ''
+
+    def html_attachments(self, doc, url):
+        """
+        HTTP 获取的页面中需要下载的附件, 无附件的栏目不需要实现
+        :return: [(attachment_url, filename)]
+        """
+        return []
+
+
 class SessionBase(SpiderBase):
     """
     base type: [1] 公众号, [2] https://www.jzl.com (第三方)
@@ -45,6 +554,7 @@ class SessionBase(SpiderBase):
             self.__thirdpart_init__(**kwargs)
         else:
             raise RuntimeError(f"required some args")
+        self.__limit_init__(**kwargs)
         # self.__config_init__()
 
     @classmethod
@@ -91,25 +601,132 @@ class SessionBase(SpiderBase):
             'verifycode': secret
         }
 
+    def __limit_init__(self, rate_limit: dict = None, daily_quota: int = None, **kwargs):
+        """
+        限流配置: 同一 host + 凭据(公众号 token / jzl key)共享令牌桶, jzl key 另有每日调用次数预算(保存在数据库, 各节点共享)
+        :param rate_limit: {"rate": 每秒请求数, "burst": 突发请求数}
+        :param daily_quota: jzl key 每日调用次数上限, 0 不限制
+        :return:
+        """
+        rate_limit = rate_limit or dict()
+        host = urlparse(self.url).hostname
+        credential = self.params.get('token') if self.base_type == 1 else self.params.get('key')
+        self.limiter = get_limiter(credential_key(host, credential), rate=rate_limit.get('rate', 0.5),
+                                   burst=rate_limit.get('burst', 1))
+        self.quota = None
+        if self.base_type == 2:
+            self.quota = get_quota(self.db, credential_key(host, credential), daily_quota)
+
     def start_request(self):
         raise NotImplementedError
 
     def get_article(self):
         """
-        获取文章列表
+        获取文章列表(第一页)
+        同一 host + 凭据的请求经过共享的限流器; 相同的请求同时只发出一次
         :return:
         """
+        key = self.http_cache.key(self.url, self.params)
+        return single_flight.do(key, self._request_articles, self.params)
+
+    def iter_articles(self, since=None, stop_at_known=True, max_pages=None, prefetch=True):
+        """
+        逐页获取文章列表并逐篇产出, 用于回溯历史文章或补抓中断期间的文章
+        公众号按 begin 偏移翻页, 第三方按 page 页码翻页
+        :param since: datetime, 遇到早于该时间的文章时停止
+        :param stop_at_known: 遇到已入库的文章时停止
+        :param max_pages: 最多请求的页数
+        :param prefetch: 处理当前页时后台请求下一页
+        :return: article
+        """
+        # 增量补抓时只有第一页参与条件请求, 第一页未变化时没有新文章;
+        # 按 since 回溯或不以已入库文章为界时, 第一页未变化也需要继续翻页, 全部无条件请求
+        conditional = since is None and stop_at_known
+        since = since.timestamp() if since else None
+        executor = ThreadPoolExecutor(max_workers=1) if prefetch else None
+
+        def _fetch(page):
+            params = self.page_params(page)
+            key = self.http_cache.key(self.url, params)
+            if page == 0 and conditional:
+                return single_flight.do(key, self._request_articles, params)
+            return single_flight.do(f'{key}:full', self._request_articles, params, conditional=False)
+
+        def _submit(page):
+            if max_pages is not None and page >= max_pages:
+                return None
+            return executor.submit(_fetch, page) if executor else page
+
+        try:
+            page = 0
+            pending = _submit(page)
+            while pending is not None:
+                articles = pending.result() if executor else _fetch(pending)
+                if not articles:
+                    return
+                page += 1
+                pending = _submit(page)
+                if stop_at_known:
+                    self.seen_urls.confirm([article.get('link') for article in articles])
+                for article in articles:
+                    if since is not None and (article.get('create_time') or 0) < since:
+                        logger.info(f"[{self.biz}] reached {datetime.fromtimestamp(since)}, stop")
+                        return
+                    if stop_at_known and article.get('link') in self.seen_urls:
+                        logger.info(f"[{self.biz}] reached known link: {article.get('link')}, stop")
+                        return
+                    yield article
+        finally:
+            if executor:
+                executor.shutdown(wait=False, cancel_futures=True)
+
+    def page_params(self, page):
+        """第 page 页(从 0 开始)的请求参数"""
+        params = dict(self.params)
+        if self.base_type == 1:
+            params['begin'] = page * params['count']
+        elif page:
+            params['page'] = page + 1
+        return params
+
+    def _request_articles(self, params, conditional=True):
         logger.info(f"Source: {self.url}")
-        resp = self.session.get(self.url, headers=self.headers, params=self.params, verify=False, timeout=5)
-        resp.raise_for_status()
+        if self.quota is not None:
+            self.quota.reserve()
+        self.limiter.acquire()
+        try:
+            with self.timer('article_list'):
+                if conditional:
+                    resp, changed = self.http_cache.get(self.session, self.url, headers=self.headers, params=params,
+                                                        verify=False, timeout=5)
+                else:
+                    resp = self.session.get(self.url, headers=self.headers, params=params, verify=False, timeout=5)
+                    resp.raise_for_status()
+                    changed = True
+        except requests.HTTPError as e:
+            if e.response is not None and (e.response.status_code == 429 or e.response.status_code >= 500):
+                self.limiter.penalize(e.response.status_code)
+            raise
+        if not changed:
+            self.limiter.reward()
+            logger.info(f"[{self.biz}] article list unchanged since last run, pass")
+            return []
         content = resp.json()
         if self.base_type == 1 and content.get('base_resp').get('ret') == 0:
+            self.limiter.reward()
             return self._articles(content)
         elif self.base_type == 2 and content.get('code') == 0:
+            self.limiter.reward()
             return self._articles(content)
+        code = content.get('base_resp', {}).get('ret') if self.base_type == 1 else content.get('code')
+        self.limiter.penalize(code)
         logger.error(f"[{resp.url}] get articles failed: {resp.text}")
         raise RuntimeError(f"[{self.site}] - failed, go pass")
 
+    def commit_source(self):
+        """文章列表处理成功, 保存其校验值; 回溯运行不调用, 不影响日常运行的条件请求"""
+        self.http_cache.commit(self.http_cache.key(self.url, self.params))
+
     def _articles(self, content):
         """
         format result
@@ -2,32 +2,34 @@
 # -*- coding: utf-8 -*-
 import sys
 sys.path.append(".")
-import re
 import traceback
 import fire
-import dateparser
 from pathlib import Path
 from urllib.parse import urljoin
 from datetime import datetime
 from loguru import logger
 from playwright.sync_api import sync_playwright
-from spider_base import SpiderBase
-from utils.settings import DATETIME_REGEXES
-from utils.tools import convert_to_relative_path, duplicate_filter, gen_invalid_record, downloader, save_page
-
-
-class FKZNSpider(SpiderBase):
-    def __init__(self, playwright, headless=None):
-        super().__init__()
-        """日志、浏览器、网站栏目配置"""
-        self.playwright = playwright
-        self.headless = headless
-        self.browser = self.playwright.firefox.launch(
-            headless=self.headless, firefox_user_prefs={'pdfjs.disabled': True, 'Content-Disposition': 'attachment'}
-        )
-        self.context = self.browser.new_context(locale='zh-CN', viewport={'width': 1920, 'height': 1080},
-                                                accept_downloads=True)
-        self.context.set_default_timeout(120 * 1000)
+from spider_base import BrowserBase, LOG_PATH
+from plugins import register_spider
+from utils.date_extract import extract_datetime
+from utils.metrics import metrics
+from utils.settings import DETAIL_CONCURRENCY, FETCH_MODE, SCREENSHOT, EXTRACT_MODE, STOP_AFTER_KNOWN
+from utils.tools import download_batch, html_visible
+
+
+@register_spider('bjrs.fkzn')
+class FKZNSpider(BrowserBase):
+    list_selector = 'div.listBox > ul > li > a'
+    detail_selector = 'div.header'
+    content_selector = 'div#mainText div.view p'
+    resource_policy = {'first_party': ('beijing.gov.cn',)}
+
+    def __init__(self, playwright, headless=None, browser_manager=None):
+        super().__init__(playwright, headless=headless, browser_manager=browser_manager)
+        self.__site_init__()
+
+    def __site_init__(self):
+        """网站栏目配置"""
         self.province = '北京'
         self.city = '北京'
         self.site = '北京市人民政府防控指南'
@@ -50,99 +52,58 @@ class FKZNSpider(SpiderBase):
         }
         self.img = dict()
 
-    def start_request(self):
-        """开始爬取"""
+    def start_request(self, concurrency=DETAIL_CONCURRENCY, fetch=FETCH_MODE, screenshot=SCREENSHOT,
+                      extract=EXTRACT_MODE, full=False, stop_after=STOP_AFTER_KNOWN):
+        """
+        开始爬取
+        默认增量爬取, 连续遇到 stop_after 个已入库链接后停止; --full 全量回溯
+        :return: 是否成功(列表未变化也视为成功), 任务表模式据此完成或重试该来源
+        """
 
         category = self.categories
         category_path = self.output_path.joinpath(self.site, category)
         if not category_path.exists():
             category_path.mkdir(parents=True)
         index_url = self.origin
+        self.screenshot = screenshot
+        self.extract = extract
+        self.load_state(category, full, stop_after)
 
+        ok = False
         try:
+            origin_html = None
+            if not full:
+                changed, origin_html = self.origin_changed(index_url)
+                if not changed:
+                    self.close()
+                    return True
             current_url = index_url
-            page = self.context.new_page()
-            page.goto(current_url)
-            # page.wait_for_timeout(2000)
-
-            page_records = []
-            links = page.query_selector_all("div.listBox > ul > li > a")
+            hrefs = []
+            if fetch == 'http':
+                hrefs = self.html_links(origin_html or self.fetch_html(current_url, stage='list'))
+            if not hrefs:
+                # 列表需要渲染时由浏览器获取
+                page = self.context.new_page()
+                page.goto(current_url)
+                # page.wait_for_timeout(2000)
+                hrefs = [link.get_attribute('href') for link in page.query_selector_all(self.list_selector)]
+                page.close()
 
-            logger.info(f"links: {links}, total: {len(links)}")
+            logger.info(f"links: {hrefs}, total: {len(hrefs)}")
             # page.pause()
-            if not links:
+            if not hrefs:
                 logger.error(f'网页无法提取链接, {current_url}')
-                return
-            for link in links:
-                href = link.get_attribute('href')
-                detail_page_url = href
-                if duplicate_filter(self.db, self.page_table, detail_page_url):
-                    logger.info(f"Duplicate link: {detail_page_url}")
-                    continue
-                if Path(href).suffix != '.html':
-                    page_record = gen_invalid_record(self.page_record, category, detail_page_url)
-                    page_records.append(page_record)
-                    continue
-                else:
-                    logger.info(detail_page_url)
-
-                for _ in range(3):
-                    try:
-                        with self.context.expect_page() as detail_page:
-                            link.click()
-                    except Exception as e:
-                        logger.warning(traceback.format_exc())
-                        continue
-                    else:
-                        break
-                detail_page.value.wait_for_timeout(2000)
-                if not detail_page.value.query_selector("div.header"):
-                    detail_page.value.close()
-                    page_record = gen_invalid_record(self.page_record, category, detail_page_url)
-                    page_records.append(page_record)
-                    continue
-
-                basename = Path(href).stem
-                file_path = category_path.joinpath(basename)
-                if not file_path.exists():
-                    file_path.mkdir()
-                record_path = file_path.joinpath('record')
-                if not record_path.exists():
-                    record_path.mkdir()
-                attachment_path = file_path.joinpath('attachment')
-                if not attachment_path.exists():
-                    attachment_path.mkdir()
-
-                with open(record_path.joinpath(f'{basename}.html'), 'w', encoding='utf-8-sig') as f:
-                    f.write(detail_page.value.content())
-                try:
-                    detail_page.value.screenshot(path=record_path.joinpath(f'{basename}.png'), full_page=True)
-                except Exception as e:
-                    logger.warning(traceback.format_exc())
-                page_record = self.parse_page(detail_page.value, category)
-                img_name = self.download_img(detail_page.value, attachment_path)
-                attachment_name = self.download_attachments(detail_page.value, attachment_path)
-                # page_record['record_path'] = str(record_path)
-                page_record['record_path'] = convert_to_relative_path(record_path)
-                if attachment_name or img_name:
-                    page_record['attachment_name'] = ",".join([attachment_name, img_name]).strip(",")
-                    logger.info(page_record['attachment_name'])
-                    # page_record['attachment_path'] = str(attachment_path)
-                    page_record['attachment_path'] = convert_to_relative_path(attachment_path)
-                detail_page.value.close()
-                page_records.append(page_record)
-                # logger.info(f"{page_record}")
-
-            page.close()
-            for opened_page in self.context.pages:
-                opened_page.close()
-
-            if page_records:
-                # pass
-                save_page(self.db, self.page_table, page_records)
+            else:
+                self.write_records(self.crawl_links(current_url, hrefs, category, category_path, concurrency, fetch))
+                if self.flush_records():
+                    self.state.update([], last_page=1)
+                    self.state.save()
+                    self.http_cache.commit(self.http_cache.key(index_url))
+                    ok = True
         except Exception as exc:
             logger.error(traceback.format_exc())
-        self.browser.close()
+        self.close()
+        return ok
 
     def parse_page(self, page, category):
         """在页面加载完成, 解析页面, 返回json object"""
@@ -169,11 +130,9 @@ class FKZNSpider(SpiderBase):
         }
         doc_info = page.query_selector("div.header")
         page_release_date = doc_info.query_selector_all("div#othermessage span")[0].text_content().strip().replace('\xa0', ' ')
-        for regex in DATETIME_REGEXES:
-            result = re.search(regex, page_release_date)
-            if result:
-                page_record['page_release_date'] = dateparser.parse(result.group(1))
-                break
+        page_release_date = extract_datetime(page_release_date)
+        if page_release_date is not None:
+            page_record['page_release_date'] = page_release_date
         page_source = doc_info.query_selector_all("div#othermessage span")[1].text_content().strip().replace('\xa0', ' ')
         page_record['page_source'] = page_source.split("：")[1]
         page_record['title'] = doc_info.query_selector("h1").text_content().strip().replace('\xa0', ' ')
@@ -197,10 +156,81 @@ class FKZNSpider(SpiderBase):
 
         return page_record
 
-    @staticmethod
-    def download_attachments(page, save_path):
+    def parse_html(self, doc, url, category):
+        """解析 HTTP 获取的页面, 选择器与 parse_page 一致"""
+        page_record = self.page_record.copy()
+        page_record['category'] = category
+        page_record['page_url'] = url
+        page_record['created_time'] = datetime.now()
+        doc_info = doc("div.header")
+        spans = doc_info.find("div#othermessage span")
+        page_release_date = extract_datetime(spans[0].text_content().strip().replace('\xa0', ' '))
+        if page_release_date is not None:
+            page_record['page_release_date'] = page_release_date
+        page_source = spans[1].text_content().strip().replace('\xa0', ' ')
+        page_record['page_source'] = page_source.split("：")[1]
+        page_record['title'] = doc_info.find("h1")[0].text_content().strip().replace('\xa0', ' ')
+
+        contents = []
+        for element in doc('div#mainText div.view p'):
+            img = element.find('.//img')
+            if img is not None:
+                logger.info(f'img: {img.get("src")}')
+                self.img[img.get("title")] = img.get("src")
+            if not html_visible(element):
+                continue
+            if not element.text_content().strip():
+                continue
+            contents.append(element.text_content().strip().replace('\xa0', ' '))
+        if contents:
+            page_record['content'] = '\n'.join(contents)
+
+        return page_record
+
+    def process_html(self, url, href, html, category, category_path):
+        """解析时收集的正文图片只属于当前页面, 解析或保存出错时同样清空, 不带到下一个页面"""
+        try:
+            return super().process_html(url, href, html, category, category_path)
+        finally:
+            self.img.clear()
+
+    def process_detail(self, detail_page, href, category, category_path):
+        try:
+            return super().process_detail(detail_page, href, category, category_path)
+        finally:
+            self.img.clear()
+
+    def html_attachments(self, doc, url):
+        targets = []
+        for attachment in doc('div.mainTextBox div#filerider a'):
+            link = attachment.get('href')
+            if link is None or attachment.text_content().strip() == '':
+                continue
+            extension = Path(link).suffix.lower()
+            if extension in ['.doc', '.docx', '.xls', '.xlsx', '.ppt', '.pptx', '.pdf', '.jpg', '.jpeg', '.png',
+                             '.webp', '.bmp', '.zip', '.rar', '.7z']:
+                if attachment.text_content().strip().lower().endswith(extension):
+                    filename = attachment.text_content().strip()
+                else:
+                    filename = attachment.text_content().strip() + extension
+                targets.append((urljoin(url, link), filename))
+        for title, link in self.img.items():
+            targets.append((urljoin(url, link), title + Path(link).suffix.lower()))
+        self.img.clear()
+        return targets
+
+    def download_attachments(self, page, save_path):
+        """正文图片与附件"""
+        img_name = self.download_img(page, save_path)
+        attachment_name = self.download_files(page, save_path)
+        attachment_name = ",".join([attachment_name, img_name]).strip(",")
+        if attachment_name:
+            logger.info(attachment_name)
+        return attachment_name
+
+    def download_files(self, page, save_path):
         """等待面渲染完成,  查找并下载页面附件"""
-        attachment_name = []
+        targets = []
         attachments = page.query_selector_all('div.mainTextBox div#filerider a')
         for attachment in attachments:
             link = attachment.get_attribute('href')
@@ -214,35 +244,27 @@ class FKZNSpider(SpiderBase):
                     filename = attachment.text_content().strip()
                 else:
                     filename = attachment.text_content().strip() + extension
-                download_path = save_path.joinpath(filename)
-                # noinspection PyBroadException
-                try:
-                    downloader(attachment_url, download_path)
-                except Exception:
-                    pass
-                else:
-                    attachment_name.append(filename)
-        return ','.join(attachment_name)
+                targets.append((attachment_url, filename, save_path.joinpath(filename)))
+        results = download_batch([(url, download_path) for url, filename, download_path in targets],
+                                 store=self.blob_store)
+        return ','.join(filename for (url, filename, download_path), ok in zip(targets, results) if ok)
 
     def download_img(self, page, save_path):
-        attachment_name = list()
+        targets = list()
         for title, link in self.img.items():
             attachment_url = urljoin(page.url, link)
             extension = Path(link).suffix.lower()
             filename = title + extension
-            download_path = save_path.joinpath(filename)
-            try:
-                downloader(attachment_url, download_path)
-            except Exception:
-                pass
-            else:
-                attachment_name.append(filename)
+            targets.append((attachment_url, filename, save_path.joinpath(filename)))
         self.img.clear()
-        return ','.join(attachment_name)
+        results = download_batch([(url, download_path) for url, filename, download_path in targets],
+                                 store=self.blob_store)
+        return ','.join(filename for (url, filename, download_path), ok in zip(targets, results) if ok)
 
 
 if __name__ == '__main__':
     logger.info("防控指南")
     with sync_playwright() as p:
         spider = FKZNSpider(p, headless=True)
-        fire.Fire(spider.start_request)
+        fire.Fire(spider.run)
+    metrics.write(LOG_PATH)
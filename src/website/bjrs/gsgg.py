@@ -2,32 +2,33 @@
 # -*- coding: utf-8 -*-
 import sys
 sys.path.append(".")
-import re
 import traceback
 import fire
-import dateparser
-from pathlib import Path
 # from urllib.parse import urljoin
 from datetime import datetime
 from loguru import logger
 from playwright.sync_api import sync_playwright
-from spider_base import SpiderBase
-from utils.settings import DATETIME_REGEXES
-from utils.tools import convert_to_relative_path, duplicate_filter, gen_invalid_record, downloader, save_page
-
-
-class GSGGSpider(SpiderBase):
-    def __init__(self, playwright, headless=None):
-        super().__init__()
-        """日志、浏览器、网站栏目配置"""
-        self.playwright = playwright
-        self.headless = headless
-        self.browser = self.playwright.firefox.launch(
-            headless=self.headless, firefox_user_prefs={'pdfjs.disabled': True, 'Content-Disposition': 'attachment'}
-        )
-        self.context = self.browser.new_context(locale='zh-CN', viewport={'width': 1920, 'height': 1080},
-                                                accept_downloads=True)
-        self.context.set_default_timeout(120 * 1000)
+from spider_base import BrowserBase, LOG_PATH
+from plugins import register_spider
+from utils.date_extract import extract_datetime
+from utils.metrics import metrics
+from utils.settings import DETAIL_CONCURRENCY, FETCH_MODE, SCREENSHOT, EXTRACT_MODE, STOP_AFTER_KNOWN
+from utils.tools import html_visible
+
+
+@register_spider('bjrs.gsgg')
+class GSGGSpider(BrowserBase):
+    list_selector = 'div.total div.main ul li > a'
+    detail_selector = 'div.contain'
+    content_selector = 'div.contain article.tc-content01 div.view p'
+    resource_policy = {'first_party': ('beijing.gov.cn',)}
+
+    def __init__(self, playwright, headless=None, browser_manager=None):
+        super().__init__(playwright, headless=headless, browser_manager=browser_manager)
+        self.__site_init__()
+
+    def __site_init__(self):
+        """网站栏目配置"""
         self.province = '北京'
         self.city = '北京'
         self.site = '北京市人民政府公示公告'
@@ -49,90 +50,59 @@ class GSGGSpider(SpiderBase):
             'created_time': None
         }
 
-    def start_request(self):
-        """开始爬取"""
+    def start_request(self, concurrency=DETAIL_CONCURRENCY, fetch=FETCH_MODE, screenshot=SCREENSHOT,
+                      extract=EXTRACT_MODE, full=False, stop_after=STOP_AFTER_KNOWN):
+        """
+        开始爬取
+        默认增量爬取, 连续遇到 stop_after 个已入库链接后停止; --full 全量回溯
+        :return: 是否成功(列表未变化也视为成功), 任务表模式据此完成或重试该来源
+        """
 
         category = self.categories
         category_path = self.output_path.joinpath(self.site, category)
         if not category_path.exists():
             category_path.mkdir(parents=True)
         index_url = self.origin
+        self.screenshot = screenshot
+        self.extract = extract
+        self.load_state(category, full, stop_after)
 
+        ok = False
         try:
+            origin_html = None
+            if not full:
+                changed, origin_html = self.origin_changed(index_url)
+                if not changed:
+                    self.close()
+                    return True
             current_url = index_url
-            page = self.context.new_page()
-            page.goto(current_url)
-            # page.wait_for_timeout(2000)
-            page_records = []
-            page.wait_for_selector('div.total')
-            links = page.query_selector_all('div.total div.main ul li > a')
-
-            logger.info(f"links: {links}, total: {len(links)}")
+            hrefs = []
+            if fetch == 'http':
+                hrefs = self.html_links(origin_html or self.fetch_html(current_url, stage='list'))
+            if not hrefs:
+                # 列表需要渲染时由浏览器获取
+                page = self.context.new_page()
+                page.goto(current_url)
+                # page.wait_for_timeout(2000)
+                page.wait_for_selector('div.total')
+                hrefs = [link.get_attribute('href') for link in page.query_selector_all(self.list_selector)]
+                page.close()
+
+            logger.info(f"links: {hrefs}, total: {len(hrefs)}")
             # page.pause()
-            if not links:
+            if not hrefs:
                 logger.error(f'网页无法提取链接, {current_url}')
-                return
-            for link in links:
-                href = link.get_attribute('href')
-                detail_page_url = href
-                if duplicate_filter(self.db, self.page_table, detail_page_url):
-                    continue
-                if Path(href).suffix != '.html':
-                    page_record = gen_invalid_record(self.page_record, category, detail_page_url)
-                    page_records.append(page_record)
-                    continue
-                else:
-                    logger.info(detail_page_url)
-
-                for _ in range(3):
-                    try:
-                        with self.context.expect_page() as detail_page:
-                            link.click()
-                    except Exception as e:
-                        logger.warning(traceback.format_exc())
-                        continue
-                    else:
-                        break
-                detail_page.value.wait_for_timeout(1000)
-                if detail_page.value.query_selector('div.contain') is None:
-                    detail_page.value.close()
-                    page_record = gen_invalid_record(self.page_record, category, detail_page_url)
-                    page_records.append(page_record)
-                    continue
-
-                basename = Path(href).stem
-                file_path = category_path.joinpath(basename)
-                if not file_path.exists():
-                    file_path.mkdir()
-                record_path = file_path.joinpath('record')
-                if not record_path.exists():
-                    record_path.mkdir()
-                attachment_path = file_path.joinpath('attachment')
-                if not attachment_path.exists():
-                    attachment_path.mkdir()
-
-                with open(record_path.joinpath(f'{basename}.html'), 'w', encoding='utf-8-sig') as f:
-                    f.write(detail_page.value.content())
-                try:
-                    detail_page.value.screenshot(path=record_path.joinpath(f'{basename}.png'), full_page=True)
-                except Exception as e:
-                    logger.warning(traceback.format_exc())
-                page_record = self.parse_page(detail_page.value, category)
-                # page_record['record_path'] = str(record_path)
-                page_record['record_path'] = convert_to_relative_path(record_path)
-                detail_page.value.close()
-                page_records.append(page_record)
-                # logger.info(f"{page_record}")
-
-            page.close()
-            for opened_page in self.context.pages:
-                opened_page.close()
-
-            if page_records:
-                save_page(self.db, self.page_table, page_records)
+            else:
+                self.write_records(self.crawl_links(current_url, hrefs, category, category_path, concurrency, fetch))
+                if self.flush_records():
+                    self.state.update([], last_page=1)
+                    self.state.save()
+                    self.http_cache.commit(self.http_cache.key(index_url))
+                    ok = True
         except Exception as exc:
             logger.error(traceback.format_exc())
-        self.browser.close()
+        self.close()
+        return ok
 
     def parse_page(self, page, category):
         """在页面加载完成, 解析页面, 返回json object"""
@@ -160,11 +130,11 @@ class GSGGSpider(SpiderBase):
         doc_info = page.query_selector('div.contain')
         article = doc_info.query_selector('article.tc-content01 div.view')
         page_record['title'] = doc_info.query_selector("h1.art_tit").text_content().strip().replace(' ', '').replace('\xa0', ' ')
-        for regex in DATETIME_REGEXES:
-            result = re.search(regex, doc_info.query_selector("div.time").text_content().strip().replace(' ', '').replace('\xa0', ' '))
-            if result:
-                page_record['page_release_date'] = dateparser.parse(result.group(1))
-                break
+        page_release_date = extract_datetime(
+            doc_info.query_selector("div.time").text_content().strip().replace(' ', '').replace('\xa0', ' ')
+        )
+        if page_release_date is not None:
+            page_record['page_release_date'] = page_release_date
         page_record['page_source'] = "北京人社"
 
         if not article:
@@ -184,9 +154,48 @@ class GSGGSpider(SpiderBase):
 
         return page_record
 
+    def parse_html(self, doc, url, category):
+        """解析 HTTP 获取的页面, 选择器与 parse_page 一致"""
+        page_record = self.page_record.copy()
+        page_record.update({
+            'category': category,
+            'page_url': url,
+            'page_release_date': '',
+            'page_source': '',
+            'title': '',
+            'content': '',
+            'attachment_name': '',
+            'created_time': datetime.now()
+        })
+        doc_info = doc('div.contain')
+        article = doc_info.find('article.tc-content01 div.view')
+        page_record['title'] = doc_info.find("h1.art_tit")[0].text_content().strip().replace(' ', '').replace('\xa0', ' ')
+        page_release_date = extract_datetime(
+            doc_info.find("div.time")[0].text_content().strip().replace(' ', '').replace('\xa0', ' ')
+        )
+        if page_release_date is not None:
+            page_record['page_release_date'] = page_release_date
+        page_record['page_source'] = "北京人社"
+
+        if not article:
+            return page_record
+
+        contents = []
+        for element in article.find('p'):
+            if not html_visible(element):
+                continue
+            if not element.text_content().strip():
+                continue
+            contents.append(element.text_content().strip().replace(' ', '').replace('\xa0', ' '))
+        if contents:
+            page_record['content'] = '\n'.join(contents)
+
+        return page_record
+
 
 if __name__ == '__main__':
     logger.info("公示公告")
     with sync_playwright() as p:
         spider = GSGGSpider(p, headless=True)
-        fire.Fire(spider.start_request)
+        fire.Fire(spider.run)
+    metrics.write(LOG_PATH)
@@ -2,32 +2,35 @@
 # -*- coding: utf-8 -*-
 import sys
 sys.path.append(".")
-import re
 import traceback
 import fire
-import dateparser
 from pathlib import Path
 from urllib.parse import urljoin
 from datetime import datetime
 from loguru import logger
+from pyquery import PyQuery as Pq
 from playwright.sync_api import sync_playwright
-from spider_base import SpiderBase
-from utils.settings import DATETIME_REGEXES
-from utils.tools import convert_to_relative_path, duplicate_filter, gen_invalid_record, downloader, save_page
-
-
-class ZFGBSpider(SpiderBase):
-    def __init__(self, playwright, headless=None):
-        super().__init__()
-        """日志、浏览器、网站栏目配置"""
-        self.playwright = playwright
-        self.headless = headless
-        self.browser = self.playwright.firefox.launch(
-            headless=self.headless, firefox_user_prefs={'pdfjs.disabled': True, 'Content-Disposition': 'attachment'}
-        )
-        self.context = self.browser.new_context(locale='zh-CN', viewport={'width': 1920, 'height': 1080},
-                                                accept_downloads=True)
-        self.context.set_default_timeout(120 * 1000)
+from spider_base import BrowserBase, LOG_PATH
+from plugins import register_spider
+from utils.date_extract import extract_datetime
+from utils.metrics import metrics
+from utils.settings import DETAIL_CONCURRENCY, FETCH_MODE, SCREENSHOT, EXTRACT_MODE, STOP_AFTER_KNOWN
+from utils.tools import download_batch, html_visible
+
+
+@register_spider('bjrs.zfgb')
+class ZFGBSpider(BrowserBase):
+    list_selector = 'ul#listcontent > li > a'
+    detail_selector = 'div.leftbox'
+    content_selector = 'div#mainText div.view p'
+    resource_policy = {'first_party': ('beijing.gov.cn',)}
+
+    def __init__(self, playwright, headless=None, browser_manager=None):
+        super().__init__(playwright, headless=headless, browser_manager=browser_manager)
+        self.__site_init__()
+
+    def __site_init__(self):
+        """网站栏目配置"""
         self.province = '北京'
         self.city = '北京'
         self.site = '北京市人民政府公报'
@@ -49,105 +52,111 @@ class ZFGBSpider(SpiderBase):
             'created_time': None
         }
 
-    def start_request(self):
-        """开始爬取"""
+    def start_request(self, concurrency=DETAIL_CONCURRENCY, fetch=FETCH_MODE, screenshot=SCREENSHOT,
+                      extract=EXTRACT_MODE, full=False, stop_after=STOP_AFTER_KNOWN):
+        """
+        开始爬取
+        默认增量爬取, 连续遇到 stop_after 个已入库链接后停止; --full 全量回溯
+        :return: 是否成功(列表未变化也视为成功), 任务表模式据此完成或重试该来源
+        """
 
         category = self.categories
         category_path = self.output_path.joinpath(self.site, category)
         if not category_path.exists():
             category_path.mkdir(parents=True)
         index_url = self.origin
+        self.screenshot = screenshot
+        self.extract = extract
+        self.load_state(category, full, stop_after)
 
+        complete, ok = True, False
         try:
+            origin_html = None
+            if not full:
+                changed, origin_html = self.origin_changed(index_url)
+                if not changed:
+                    self.close()
+                    return True
+            pages_done = 0
             current_url = index_url
-            page = self.context.new_page()
-            page.goto(current_url)
-            # page.wait_for_timeout(2000)
-            page_handle = page.query_selector_all("div.qzb div.changepage > a")
-            page_total = int(page_handle[-2].get_attribute("data-page").strip())
-            logger.info(f"page_total: {page_total}")
-            page_records = []
-            while page_total:
-                page_total -= 1
-                page.wait_for_selector('ul#listcontent')
-                links = page.query_selector_all('ul#listcontent > li > a')
-
-                logger.info(f"links: {links}, total: {len(links)}")
-                # page.pause()
-                if not links:
-                    logger.error(f'网页无法提取链接, {current_url}')
-                    return
-                for link in links:
-                    href = link.get_attribute('href')
-                    detail_page_url = href
-                    if duplicate_filter(self.db, self.page_table, detail_page_url):
-                        continue
-                    if Path(href).suffix != '.html':
-                        page_record = gen_invalid_record(self.page_record, category, detail_page_url)
-                        page_records.append(page_record)
-                        continue
+            if fetch == 'http':
+                # 翻页链接为真实地址时继续 HTTP 翻页, 否则剩余页交给浏览器
+                while current_url:
+                    if current_url == index_url and origin_html:
+                        html = origin_html
                     else:
-                        logger.info(detail_page_url)
-
-                    for _ in range(3):
-                        try:
-                            with self.context.expect_page() as detail_page:
-                                link.click()
-                        except Exception as e:
-                            logger.warning(traceback.format_exc())
-                            continue
-                        else:
-                            break
-                    detail_page.value.wait_for_timeout(1000)
-                    if detail_page.value.query_selector('div.leftbox') is None:
-                        detail_page.value.close()
-                        page_record = gen_invalid_record(self.page_record, category, detail_page_url)
-                        page_records.append(page_record)
-                        continue
-
-                    basename = Path(href).stem
-                    file_path = category_path.joinpath(basename)
-                    if not file_path.exists():
-                        file_path.mkdir()
-                    record_path = file_path.joinpath('record')
-                    if not record_path.exists():
-                        record_path.mkdir()
-                    attachment_path = file_path.joinpath('attachment')
-                    if not attachment_path.exists():
-                        attachment_path.mkdir()
-
-                    with open(record_path.joinpath(f'{basename}.html'), 'w', encoding='utf-8-sig') as f:
-                        f.write(detail_page.value.content())
-                    try:
-                        detail_page.value.screenshot(path=record_path.joinpath(f'{basename}.png'), full_page=True)
-                    except Exception as e:
-                        logger.warning(traceback.format_exc())
-                    page_record = self.parse_page(detail_page.value, category)
-                    attachment_name = self.download_attachments(detail_page.value, attachment_path)
-                    # page_record['record_path'] = str(record_path)
-                    page_record['record_path'] = convert_to_relative_path(record_path)
-                    if attachment_name:
-                        page_record['attachment_name'] = attachment_name
-                        # page_record['attachment_path'] = str(attachment_path)
-                        page_record['attachment_path'] = convert_to_relative_path(attachment_path)
-                    detail_page.value.close()
-                    page_records.append(page_record)
-                    # logger.info(f"{page_record}")
-
-                if not page.query_selector('div.qzb div.changepage > a.next'):
-                    break
-                _next = page.query_selector('div.qzb div.changepage > a.next')
-                _next.click()
-
-            page.close()
-            for opened_page in self.context.pages:
-                opened_page.close()
-
-            if page_records:
-                save_page(self.db, self.page_table, page_records)
+                        html = self.fetch_html(current_url, stage='list')
+                    hrefs = self.html_links(html)
+                    if not hrefs:
+                        break
+                    logger.info(f"links: {len(hrefs)}, {current_url}")
+                    self.write_records(self.crawl_links(current_url, hrefs, category, category_path, concurrency,
+                                                        fetch))
+                    pages_done += 1
+                    if self.stop_reached:
+                        fetch = None
+                        break
+                    pager = Pq(html, parser='html')('div.qzb div.changepage')
+                    _next = pager.children('a.next')
+                    if pager and not _next:
+                        # 已是最后一页
+                        fetch = None
+                        break
+                    next_href = _next.attr('href')
+                    if not next_href or next_href.startswith(('javascript', '#')):
+                        break
+                    current_url = urljoin(current_url, next_href)
+
+            if fetch is not None:
+                current_url = index_url
+                page = self.context.new_page()
+                page.goto(current_url)
+                # page.wait_for_timeout(2000)
+                page_handle = page.query_selector_all("div.qzb div.changepage > a")
+                page_total = int(page_handle[-2].get_attribute("data-page").strip())
+                logger.info(f"page_total: {page_total}")
+                # 跳过已通过 HTTP 处理的列表页
+                for _ in range(pages_done):
+                    page_total -= 1
+                    page.wait_for_selector('ul#listcontent')
+                    page.query_selector('div.qzb div.changepage > a.next').click()
+                while page_total > 0:
+                    page_total -= 1
+                    page.wait_for_selector('ul#listcontent')
+                    links = page.query_selector_all(self.list_selector)
+
+                    logger.info(f"links: {links}, total: {len(links)}")
+                    # page.pause()
+                    if not links:
+                        # 列表页异常, 已抓取的记录照常写入, 但不保存增量状态与校验值, 下次运行重新翻页
+                        logger.error(f'网页无法提取链接, {current_url}')
+                        complete = False
+                        break
+                    hrefs = [link.get_attribute('href') for link in links]
+                    self.write_records(self.crawl_links(page.url, hrefs, category, category_path, concurrency,
+                                                        fetch))
+                    pages_done += 1
+                    if self.stop_reached:
+                        break
+
+                    if not page.query_selector('div.qzb div.changepage > a.next'):
+                        break
+                    _next = page.query_selector('div.qzb div.changepage > a.next')
+                    _next.click()
+
+                page.close()
+                for opened_page in self.context.pages:
+                    opened_page.close()
+
+            if complete and self.flush_records():
+                self.state.update([], last_page=pages_done)
+                self.state.save()
+                self.http_cache.commit(self.http_cache.key(index_url))
+                ok = True
         except Exception as exc:
             logger.error(traceback.format_exc())
-        self.browser.close()
+        self.close()
+        return ok
 
     def parse_page(self, page, category):
         """在页面加载完成, 解析页面, 返回json object"""
@@ -175,11 +184,9 @@ class ZFGBSpider(SpiderBase):
         doc_info = page.query_selector_all('ol.doc-info li')
         for li in doc_info:
             if li.text_content().strip().startswith("[发布日期]"):
-                for regex in DATETIME_REGEXES:
-                    result = re.search(regex, li.query_selector("span").text_content().strip().replace('\xa0', ' '))
-                    if result:
-                        page_record['page_release_date'] = dateparser.parse(result.group(1))
-                        break
+                page_release_date = extract_datetime(li.query_selector("span").text_content().strip().replace('\xa0', ' '))
+                if page_release_date is not None:
+                    page_record['page_release_date'] = page_release_date
             if li.text_content().strip().startswith("[发文机构]"):
                 page_record['page_source'] = li.query_selector("span").text_content().strip().replace('\xa0', ' ')
         page_record['title'] = page.query_selector("div.header h1 p").text_content().strip().replace('\xa0', ' ')
@@ -199,10 +206,56 @@ class ZFGBSpider(SpiderBase):
 
         return page_record
 
-    @staticmethod
-    def download_attachments(page, save_path):
+    def parse_html(self, doc, url, category):
+        """解析 HTTP 获取的页面, 选择器与 parse_page 一致"""
+        page_record = self.page_record.copy()
+        page_record['category'] = category
+        page_record['page_url'] = url
+        page_record['created_time'] = datetime.now()
+        for li in doc('ol.doc-info li'):
+            span = li.find('.//span')
+            if li.text_content().strip().startswith("[发布日期]"):
+                page_release_date = extract_datetime(span.text_content().strip().replace('\xa0', ' '))
+                if page_release_date is not None:
+                    page_record['page_release_date'] = page_release_date
+            if li.text_content().strip().startswith("[发文机构]"):
+                page_record['page_source'] = span.text_content().strip().replace('\xa0', ' ')
+        # lxml 会把 h1 中的 p 移到 h1 之后
+        title = doc("div.header h1 p") or doc("div.header h1 + p")
+        page_record['title'] = title[0].text_content().strip().replace('\xa0', ' ')
+
+        contents = []
+        for element in doc('div#mainText div.view p'):
+            if not html_visible(element):
+                continue
+            if not element.text_content().strip():
+                continue
+            contents.append(element.text_content().strip().replace('\xa0', ' '))
+        if contents:
+            page_record['content'] = '\n'.join(contents)
+
+        return page_record
+
+    def html_attachments(self, doc, url):
+        targets = []
+        for attachment in doc('div.mainTextBox ul.fujian li'):
+            a = attachment.find('.//a')
+            link = a.get('href') if a is not None else None
+            if link is None or attachment.text_content().strip() == '':
+                continue
+            extension = Path(link).suffix.lower()
+            if extension in ['.doc', '.docx', '.xls', '.xlsx', '.ppt', '.pptx', '.pdf', '.jpg', '.jpeg', '.png',
+                             '.webp', '.bmp', '.zip', '.rar', '.7z']:
+                if attachment.text_content().strip().lower().endswith(extension):
+                    filename = attachment.text_content().strip()
+                else:
+                    filename = attachment.text_content().strip() + extension
+                targets.append((urljoin(url, link), filename))
+        return targets
+
+    def download_attachments(self, page, save_path):
         """等待面渲染完成,  查找并下载页面附件"""
-        attachment_name = []
+        targets = []
         attachments = page.query_selector_all('div.mainTextBox ul.fujian li')
         for attachment in attachments:
             link = attachment.query_selector('a').get_attribute('href')
@@ -216,19 +269,15 @@ class ZFGBSpider(SpiderBase):
                     filename = attachment.text_content().strip()
                 else:
                     filename = attachment.text_content().strip() + extension
-                download_path = save_path.joinpath(filename)
-                # noinspection PyBroadException
-                try:
-                    downloader(attachment_url, download_path)
-                except Exception:
-                    pass
-                else:
-                    attachment_name.append(filename)
-        return ','.join(attachment_name)
+                targets.append((attachment_url, filename, save_path.joinpath(filename)))
+        results = download_batch([(url, download_path) for url, filename, download_path in targets],
+                                 store=self.blob_store)
+        return ','.join(filename for (url, filename, download_path), ok in zip(targets, results) if ok)
 
 
 if __name__ == '__main__':
     logger.info("政府公报")
     with sync_playwright() as p:
         spider = ZFGBSpider(p, headless=True)
-        fire.Fire(spider.start_request)
+        fire.Fire(spider.run)
+    metrics.write(LOG_PATH)
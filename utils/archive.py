@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+分段压缩归档
+页面 HTML 与截图按 WARC 记录格式追加写入 <目录>/archive/<segment>.warc.zst, 每条记录是一个独立的 zstd 帧,
+可以从记录偏移处单独解压; <segment>.idx 每行记录 "偏移\t长度\t类型\t名称\turl".
+单个段达到 max_bytes 后新开一段. 记录的 record_path 为 "<段文件相对路径>#<偏移>:<压缩后长度>",
+读取时只读这一帧, 不需要查 .idx.
+未安装 zstandard 时改用 gzip(每条记录一个 gzip member), 段文件后缀为 .warc.gz.
+"""
+import os
+import gzip
+import zlib
+import uuid
+import threading
+from pathlib import Path
+from datetime import datetime, timezone
+from loguru import logger
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+_archives = dict()
+_archives_lock = threading.Lock()
+
+
+def get_archive(root, **kwargs):
+    """同一根目录在进程内只创建一个 Archive"""
+    root = Path(root)
+    with _archives_lock:
+        if root not in _archives:
+            _archives[root] = Archive(root, **kwargs)
+        return _archives[root]
+
+
+def _compress(data, level):
+    if zstandard is not None:
+        return zstandard.ZstdCompressor(level=level).compress(data)
+    return gzip.compress(data, compresslevel=6)
+
+
+def _decompressor(suffix):
+    if suffix == '.zst':
+        if zstandard is None:
+            raise RuntimeError("zstandard is required to read .warc.zst segments: pip install zstandard")
+        return zstandard.ZstdDecompressor().decompressobj()
+    return zlib.decompressobj(31)
+
+
+def _decompress(data, suffix):
+    """只解压 data 开头的一帧(gzip member)"""
+    return _decompressor(suffix).decompress(data)
+
+
+def _decompress_stream(f, suffix, chunk_size=1 << 16):
+    """从文件当前位置流式解压一帧, 到帧结尾即停止, 不读取段文件的其余部分"""
+    decompressor = _decompressor(suffix)
+    output = list()
+    while not decompressor.eof:
+        chunk = f.read(chunk_size)
+        if not chunk:
+            break
+        output.append(decompressor.decompress(chunk))
+    return b''.join(output)
+
+
+def warc_record(url, body, content_type, name=None):
+    """WARC/1.1 resource 记录"""
+    headers = [
+        'WARC/1.1',
+        'WARC-Type: resource',
+        f'WARC-Record-ID: <urn:uuid:{uuid.uuid4()}>',
+        f'WARC-Date: {datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")}',
+        f'WARC-Target-URI: {url}',
+        f'Content-Type: {content_type}',
+        f'Content-Length: {len(body)}',
+    ]
+    if name:
+        headers.append(f'WARC-Filename: {name}')
+    return '\r\n'.join(headers).encode('utf-8') + b'\r\n\r\n' + body + b'\r\n\r\n'
+
+
+def parse_warc_record(data):
+    """
+    :return: (headers, body)
+    """
+    head, _, rest = data.partition(b'\r\n\r\n')
+    lines = head.decode('utf-8').split('\r\n')
+    headers = dict(line.split(': ', 1) for line in lines[1:] if ': ' in line)
+    length = int(headers.get('Content-Length', len(rest)))
+    return headers, rest[:length]
+
+
+class Segment(object):
+    """一个目录下当前写入的段文件"""
+    def __init__(self, directory, max_bytes):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.suffix = '.warc.zst' if zstandard is not None else '.warc.gz'
+        self.lock = threading.Lock()
+        self.path = None
+        self.size = 0
+        self._roll()
+
+    def _roll(self):
+        name = f'{datetime.now():%Y%m%d%H%M%S}-{os.getpid()}-{uuid.uuid4().hex[:8]}'
+        self.path = self.directory / f'{name}{self.suffix}'
+        self.size = 0
+
+    def append(self, frame, index_line):
+        """
+        :return: (段文件路径, 偏移)
+        """
+        with self.lock:
+            if self.size and self.size + len(frame) > self.max_bytes:
+                self._roll()
+            offset = self.size
+            with open(self.path, 'ab') as f:
+                f.write(frame)
+            with open(self.path.with_suffix('.idx'), 'a', encoding='utf-8') as f:
+                f.write(f'{offset}\t{len(frame)}\t{index_line}\n')
+            self.size += len(frame)
+            return self.path, offset
+
+
+class Archive(object):
+    def __init__(self, root, max_bytes=1 << 30, level=10):
+        """
+        :param root: output 目录, record_path 相对于其上一级(与 convert_to_relative_path 一致)
+        :param max_bytes: 单个段文件的大小上限
+        :param level: zstd 压缩级别
+        """
+        self.root = Path(root)
+        self.max_bytes = max_bytes
+        self.level = level
+        self._segments = dict()
+        self._lock = threading.Lock()
+        if zstandard is None:
+            logger.warning("zstandard not installed, archive segments use gzip")
+
+    def segment(self, category_path):
+        directory = Path(category_path) / 'archive'
+        with self._lock:
+            if directory not in self._segments:
+                self._segments[directory] = Segment(directory, self.max_bytes)
+            return self._segments[directory]
+
+    def append(self, category_path, url, body, content_type='text/html; charset=utf-8', name=None):
+        """
+        追加一条记录
+        :param category_path: 栏目目录, 段文件位于其下的 archive 目录
+        :param url:
+        :param body: str 按 utf-8 编码
+        :param content_type:
+        :param name: 原本的文件名
+        :return: record_path, "<段文件相对路径>#<偏移>:<压缩后长度>"
+        """
+        if isinstance(body, str):
+            body = body.encode('utf-8')
+        frame = _compress(warc_record(url, body, content_type, name), self.level)
+        kind = content_type.split(';', 1)[0]
+        path, offset = self.segment(category_path).append(frame, f'{kind}\t{name or ""}\t{url}')
+        return f'{path.relative_to(self.root.parent).as_posix()}#{offset}:{len(frame)}'
+
+    def read(self, record_path):
+        """
+        按 record_path 读取一条记录
+        :return: (headers, body)
+        """
+        return read_record(self.root.parent, record_path)
+
+
+def read_record(base, record_path):
+    """
+    :param base: output 目录的上一级
+    :param record_path: "<段文件相对路径>#<偏移>:<压缩后长度>";
+                        早期的 "<段文件相对路径>#<偏移>" 没有长度, 从偏移处流式解压到帧结尾
+    :return: (headers, body)
+    """
+    segment, position = record_path.rsplit('#', 1)
+    offset, _, length = position.partition(':')
+    path = Path(base) / segment
+    with open(path, 'rb') as f:
+        f.seek(int(offset))
+        if length:
+            data = _decompress(f.read(int(length)), path.suffix)
+        else:
+            data = _decompress_stream(f, path.suffix)
+    return parse_warc_record(data)
+
+
+def is_archived(record_path):
+    return bool(record_path) and '#' in record_path
@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import asyncio
+import functools
+import requests
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+from utils.tools import downloader
+
+
+class AsyncFetcher(object):
+    """
+    asyncio 并发抓取, 按 host 限制同时进行的请求数.
+    请求仍由 requests 发出(复用 session 连接池、verify/timeout 等行为与同步模式一致),
+    在独立线程池中执行, 事件循环只负责调度.
+    """
+    def __init__(self, session=None, per_host=4, max_workers=16, store=None):
+        self.session = session or requests.session()
+        self.store = store
+        self.per_host = per_host
+        self._semaphores = dict()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+
+    def _semaphore(self, url):
+        host = urlparse(url).netloc
+        if host not in self._semaphores:
+            self._semaphores[host] = asyncio.Semaphore(self.per_host)
+        return self._semaphores[host]
+
+    async def run(self, url, func, *args, **kwargs):
+        """
+        在 url 所属 host 的并发限制内执行阻塞调用
+        :param url:
+        :param func:
+        :return:
+        """
+        async with self._semaphore(url):
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._executor, functools.partial(func, *args, **kwargs))
+
+    async def get(self, url, **kwargs):
+        return await self.run(url, self.session.get, url, **kwargs)
+
+    async def download(self, url, save_path):
+        if self.store is not None:
+            return await self.run(url, self.store.fetch, url, save_path)
+        return await self.run(url, downloader, url, save_path)
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import os
+import shutil
+import hashlib
+import threading
+from pathlib import Path
+from loguru import logger
+from utils.tools import downloader
+
+_stores = dict()
+_stores_lock = threading.Lock()
+
+
+def get_blob_store(root):
+    """同一目录在进程内只创建一个 BlobStore"""
+    root = Path(root)
+    with _stores_lock:
+        if root not in _stores:
+            _stores[root] = BlobStore(root)
+        return _stores[root]
+
+
+class BlobStore(object):
+    """
+    按 SHA-256 寻址的附件仓库, 文件保存在 <root>/<sha[:2]>/<sha[2:4]>/<sha>;
+    各记录 attachment 目录中的文件是指向 blob 的硬链接(跨文件系统时退化为复制),
+    相同内容只占一份磁盘空间.
+    url -> sha256 的对应关系追加记录在 <root>/urls.idx, 已下载过的 url 直接链接, 不再下载.
+    """
+    def __init__(self, root):
+        self.root = Path(root)
+        self.tmp_path = self.root / 'tmp'
+        self.tmp_path.mkdir(parents=True, exist_ok=True)
+        self.index_path = self.root / 'urls.idx'
+        self._urls = dict()
+        self._lock = threading.Lock()
+        self._url_locks = dict()
+        self._load()
+
+    def _load(self):
+        if not self.index_path.exists():
+            return
+        with open(self.index_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                digest, _, url = line.rstrip('\n').partition('\t')
+                if digest and url:
+                    self._urls[url] = digest
+        logger.info(f"Blob store loaded: {self.root}, {len(self._urls)} urls")
+
+    def _remember(self, url, digest):
+        with self._lock:
+            if self._urls.get(url) == digest:
+                return
+            self._urls[url] = digest
+            with open(self.index_path, 'a', encoding='utf-8') as f:
+                f.write(f'{digest}\t{url}\n')
+
+    def _url_lock(self, url):
+        with self._lock:
+            return self._url_locks.setdefault(url, threading.Lock())
+
+    def blob_path(self, digest):
+        return self.root / digest[:2] / digest[2:4] / digest
+
+    def known(self, url):
+        """
+        已下载过且 blob 仍存在时返回 sha256
+        :param url:
+        :return:
+        """
+        digest = self._urls.get(url)
+        if digest and self.blob_path(digest).exists():
+            return digest
+        return None
+
+    def put(self, file_path):
+        """
+        将文件移入仓库, 内容已存在时丢弃该文件
+        :param file_path:
+        :return: sha256
+        """
+        sha256 = hashlib.sha256()
+        with open(file_path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                sha256.update(chunk)
+        digest = sha256.hexdigest()
+        blob_path = self.blob_path(digest)
+        if blob_path.exists():
+            os.unlink(file_path)
+        else:
+            blob_path.parent.mkdir(parents=True, exist_ok=True)
+            os.replace(file_path, blob_path)
+        return digest
+
+    def link(self, digest, save_path):
+        """在记录的 attachment 目录中建立指向 blob 的硬链接"""
+        save_path = Path(save_path)
+        if save_path.exists():
+            save_path.unlink()
+        try:
+            os.link(self.blob_path(digest), save_path)
+        except OSError:
+            shutil.copyfile(self.blob_path(digest), save_path)
+
+    def fetch(self, url, save_path):
+        """
+        下载(或复用)附件并链接到 save_path
+        临时文件名由 url 决定, 中断后再次下载同一 url 时可以断点续传
+        :param url:
+        :param save_path:
+        :return: sha256
+        """
+        with self._url_lock(url):
+            digest = self.known(url)
+            if digest is None:
+                tmp_file = self.tmp_path / hashlib.sha256(url.encode('utf-8')).hexdigest()
+                downloader(url, tmp_file)
+                digest = self.put(tmp_file)
+                self._remember(url, digest)
+            else:
+                logger.info(f"Known attachment: {url}")
+        self.link(digest, save_path)
+        return digest
@@ -0,0 +1,304 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import re
+import traceback
+from html import escape
+from contextlib import nullcontext
+from collections import deque, Counter
+from urllib.parse import urlparse
+from loguru import logger
+
+HIDDEN_ATTRIBUTE = 'data-spider-hidden'
+# 按 playwright is_visible 的规则(包围盒非空且 visibility 不为 hidden)标记不可见元素, 返回整页 HTML
+MARK_HIDDEN_SCRIPT = """
+(selector) => {
+    if (selector) {
+        for (const element of document.querySelectorAll(selector)) {
+            const rect = element.getBoundingClientRect();
+            if (!(rect.width > 0 && rect.height > 0) || getComputedStyle(element).visibility === 'hidden') {
+                element.setAttribute('%s', '');
+            }
+        }
+    }
+    return document.documentElement.outerHTML;
+}
+""" % HIDDEN_ATTRIBUTE
+
+
+class ScreenshotPolicy(object):
+    """
+    截图策略
+    mode: off 不截图 / viewport 只截首屏 / full 整页; image_type: jpeg(按 quality 压缩) / png.
+    playwright 只支持输出 png 与 jpeg.
+    """
+    MODES = ('off', 'viewport', 'full')
+
+    def __init__(self, mode='off', image_type='jpeg', quality=60):
+        if mode is True:
+            mode = 'full'
+        elif not mode:
+            mode = 'off'
+        if mode not in self.MODES:
+            raise ValueError(f"screenshot mode must be one of {self.MODES}: {mode}")
+        if image_type not in ('jpeg', 'png'):
+            raise ValueError(f"screenshot type must be jpeg or png: {image_type}")
+        self.mode = mode
+        self.image_type = image_type
+        self.quality = quality
+
+    def __bool__(self):
+        return self.mode != 'off'
+
+    def __repr__(self):
+        return f'ScreenshotPolicy({self.mode}, {self.image_type})'
+
+    @property
+    def suffix(self):
+        return '.jpg' if self.image_type == 'jpeg' else '.png'
+
+    @property
+    def content_type(self):
+        return f'image/{self.image_type}'
+
+    def options(self):
+        """page.screenshot 的参数"""
+        options = {'full_page': self.mode == 'full', 'type': self.image_type}
+        if self.image_type == 'jpeg':
+            options['quality'] = self.quality
+        return options
+
+
+def with_base(html, url):
+    """在保存的 HTML 中加入 <base>, set_content 渲染时相对地址的样式、图片按原页面地址加载"""
+    tag = f'<base href="{escape(url, quote=True)}">'
+    match = re.search(r'<head[^>]*>', html, re.I)
+    if match:
+        return html[:match.end()] + tag + html[match.end():]
+    return tag + html
+
+
+class BrowserManager(object):
+    """
+    浏览器管理
+    同一 playwright 实例下只启动一个 firefox 进程, 每个爬虫通过 acquire 获得独立的浏览器上下文(new_context);
+    上下文用完后 release 归还: 关闭页面、清除 cookie 与权限后留给下一个爬虫复用, 复用 max_uses 次后关闭重建.
+    playwright 同步接口只能在创建它的线程中使用, 一个管理器对应一个线程.
+    """
+    LAUNCH_OPTIONS = {'firefox_user_prefs': {'pdfjs.disabled': True, 'Content-Disposition': 'attachment'}}
+    CONTEXT_OPTIONS = {'locale': 'zh-CN', 'viewport': {'width': 1920, 'height': 1080}, 'accept_downloads': True}
+
+    def __init__(self, playwright, headless=None, max_uses=20, timeout=120 * 1000):
+        self.playwright = playwright
+        self.headless = headless
+        self.max_uses = max_uses
+        self.timeout = timeout
+        self._browser = None
+        self._idle = deque()
+        self._uses = dict()
+
+    @property
+    def browser(self):
+        """首次使用时启动"""
+        if self._browser is None:
+            self._browser = self.playwright.firefox.launch(headless=self.headless, **self.LAUNCH_OPTIONS)
+        return self._browser
+
+    def acquire(self):
+        """取一个空闲上下文, 没有时新建"""
+        if self._idle:
+            context = self._idle.popleft()
+        else:
+            context = self.browser.new_context(**self.CONTEXT_OPTIONS)
+            self._uses[context] = 0
+        context.set_default_timeout(self.timeout)
+        self._uses[context] += 1
+        return context
+
+    def release(self, context):
+        """归还上下文, 清理失败或达到复用次数时关闭"""
+        try:
+            for page in list(context.pages):
+                page.close()
+            context.clear_cookies()
+            context.clear_permissions()
+        except Exception:
+            logger.warning(traceback.format_exc())
+            self._discard(context)
+            return
+        if self._uses.get(context, 0) >= self.max_uses:
+            self._discard(context)
+        else:
+            self._idle.append(context)
+
+    def _discard(self, context):
+        self._uses.pop(context, None)
+        try:
+            context.close()
+        except Exception:
+            logger.warning(traceback.format_exc())
+
+    def close(self):
+        """关闭全部上下文与浏览器"""
+        while self._idle:
+            self._discard(self._idle.popleft())
+        if self._browser is not None:
+            self._browser.close()
+            self._browser = None
+        self._uses.clear()
+
+
+class DetailPagePool(object):
+    """
+    详情页页面池
+    同一浏览器上下文中最多同时打开 size 个页面, 页面在浏览器中并行加载;
+    调用方按顺序处理已就绪的页面, 每处理完一个就关闭并补开下一个,
+    一页列表的耗时接近其中最慢的详情页, 而不是所有详情页之和.
+    """
+    def __init__(self, context, size=4, ready_selector=None, ready_timeout=10 * 1000, timer=None):
+        """
+        :param context:
+        :param size: 同时打开的页面数
+        :param ready_selector: 就绪标志元素
+        :param ready_timeout:
+        :param timer: 返回上下文管理器的函数, 用于记录等待页面就绪的耗时
+        """
+        self.context = context
+        self.size = max(int(size), 1)
+        self.ready_selector = ready_selector
+        self.ready_timeout = ready_timeout
+        self.timer = timer or nullcontext
+
+    def _open(self, url):
+        page = self.context.new_page()
+        try:
+            # 只等待响应开始, 页面其余部分在后台继续加载
+            page.goto(url, wait_until='commit')
+        except Exception:
+            logger.warning(traceback.format_exc())
+        return page
+
+    def _ready(self, page):
+        """页面 DOM 解析完成且出现就绪标志元素"""
+        try:
+            page.wait_for_load_state('domcontentloaded')
+            if self.ready_selector:
+                page.wait_for_selector(self.ready_selector, state='attached', timeout=self.ready_timeout)
+        except Exception:
+            logger.warning(f"detail page not ready: {page.url}")
+            return False
+        return True
+
+    def map(self, targets):
+        """
+        按顺序产出已就绪的详情页
+        :param targets: [(key, url)]
+        :return: (key, page), 页面未就绪时 page 为 None; 页面在处理完后由页面池关闭
+        """
+        targets = iter(targets)
+        pending = deque()
+
+        def _fill():
+            while len(pending) < self.size:
+                target = next(targets, None)
+                if target is None:
+                    return
+                key, url = target
+                pending.append((key, self._open(url)))
+
+        _fill()
+        try:
+            while pending:
+                key, page = pending.popleft()
+                _fill()
+                with self.timer():
+                    ready = self._ready(page)
+                try:
+                    yield key, page if ready else None
+                finally:
+                    page.close()
+        finally:
+            for key, page in pending:
+                page.close()
+
+
+class ResourcePolicy(object):
+    """
+    浏览器请求拦截(context.route)
+    中止字体、媒体、第三方脚本, 以及不需要截图时的图片请求;
+    页面文档、样式(影响 is_visible 判断)和同站脚本照常加载.
+    按页面统计拦截与放行的请求数; 被中止的请求没有响应, 无法得知其字节数, 因此只报告拦截的请求数而不估算节省的流量.
+    页面关闭时清除其统计, 未经 pop_stats 取出的页面(出错、超时)不会一直留在上下文的统计中.
+    """
+    def __init__(self, first_party=(), block_types=('font', 'media'), block_third_party_scripts=True,
+                 block_images=False):
+        """
+        :param first_party: 同站域名后缀, 其余域名的脚本视为第三方
+        :param block_types: 始终拦截的资源类型
+        :param block_third_party_scripts:
+        :param block_images: 拦截图片(不截图时不影响文本与链接提取)
+        """
+        self.first_party = tuple(first_party)
+        self.block_types = set(block_types)
+        self.block_third_party_scripts = block_third_party_scripts
+        self.block_images = block_images
+        self._stats = dict()
+        self.total = {'blocked': 0, 'blocked_types': Counter(), 'allowed': 0}
+
+    def install(self, context):
+        context.route('**/*', self._handle)
+        context.on('response', self._on_response)
+
+    def uninstall(self, context):
+        """上下文归还给 BrowserManager 前移除拦截, 下一个爬虫安装自己的规则"""
+        try:
+            context.unroute('**/*', self._handle)
+            context.remove_listener('response', self._on_response)
+        except Exception:
+            logger.warning(traceback.format_exc())
+
+    def _first_party(self, url):
+        host = urlparse(url).hostname or ''
+        return any(host == domain or host.endswith('.' + domain) for domain in self.first_party)
+
+    def blocked(self, request):
+        resource_type = request.resource_type
+        if resource_type in self.block_types:
+            return True
+        if self.block_images and resource_type == 'image':
+            return True
+        if self.block_third_party_scripts and resource_type == 'script' and self.first_party:
+            return not self._first_party(request.url)
+        return False
+
+    def _page_stats(self, request):
+        try:
+            page = request.frame.page
+        except Exception:
+            return None
+        if page not in self._stats:
+            self._stats[page] = {'blocked': 0, 'blocked_types': Counter(), 'allowed': 0}
+            page.once('close', self.pop_stats)
+        return self._stats[page]
+
+    def _handle(self, route):
+        request = route.request
+        stats = self._page_stats(request)
+        if self.blocked(request):
+            if stats is not None:
+                stats['blocked'] += 1
+                stats['blocked_types'][request.resource_type] += 1
+            self.total['blocked'] += 1
+            self.total['blocked_types'][request.resource_type] += 1
+            route.abort()
+        else:
+            route.continue_()
+
+    def _on_response(self, response):
+        stats = self._page_stats(response.request)
+        if stats is not None:
+            stats['allowed'] += 1
+        self.total['allowed'] += 1
+
+    def pop_stats(self, page):
+        """取出并清除页面的拦截统计"""
+        return self._stats.pop(page, None)
@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import json
+import threading
+from pathlib import Path
+from datetime import datetime
+from loguru import logger
+
+
+class CrawlState(object):
+    """
+    站点/栏目的增量爬取状态: 最新的链接与发布时间、最近一次到达的列表页
+    保存在 <root>/<site>_<category>.json, 运行成功结束后写入
+    """
+    def __init__(self, root, site, category):
+        self.path = Path(root) / f'{site}_{category}.json'
+        self.newest_url = None
+        self.newest_date = None
+        self.last_page = 0
+        self.updated_time = None
+        self._lock = threading.Lock()
+        self.load()
+
+    def load(self):
+        if not self.path.exists():
+            return
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                state = json.load(f)
+        except Exception:
+            logger.warning(f"crawl state broken, ignored: {self.path}")
+            return
+        self.newest_url = state.get('newest_url')
+        self.newest_date = datetime.fromisoformat(state['newest_date']) if state.get('newest_date') else None
+        self.last_page = state.get('last_page') or 0
+        self.updated_time = state.get('updated_time')
+        logger.info(f"Crawl state: newest {self.newest_date} {self.newest_url}, last page {self.last_page}")
+
+    def update(self, page_records, last_page=None):
+        """
+        按本次入库的记录更新状态
+        :param page_records:
+        :param last_page: 本次到达的列表页页码
+        :return:
+        """
+        with self._lock:
+            for record in page_records:
+                release_date = record.get('page_release_date')
+                if not isinstance(release_date, datetime):
+                    continue
+                if self.newest_date is None or release_date > self.newest_date:
+                    self.newest_date = release_date
+                    self.newest_url = record.get('page_url')
+            if last_page is not None:
+                self.last_page = last_page
+
+    def save(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        state = {
+            'newest_url': self.newest_url,
+            'newest_date': self.newest_date.isoformat() if self.newest_date else None,
+            'last_page': self.last_page,
+            'updated_time': datetime.now().isoformat(timespec='seconds')
+        }
+        tmp_path = self.path.with_suffix('.tmp')
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(state, f, ensure_ascii=False, indent=2)
+        tmp_path.replace(self.path)
@@ -1,14 +1,57 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
-
+import os
+import threading
 from sqlalchemy import create_engine, MetaData
-from utils.settings import DB_ENGINE, DB_HOST, DB_PORT, DB_USERNAME, DB_PASSWORD, DB_NAME
+from utils.settings import DB_ENGINE, DB_HOST, DB_PORT, DB_USERNAME, DB_PASSWORD, DB_NAME, DB_POOL_SIZE, \
+    DB_MAX_OVERFLOW
 
 
 class Database(object):
-    def __init__(self):
+    _shared = None
+    _shared_pid = None
+    _lock = threading.Lock()
+    _pool_size = DB_POOL_SIZE
+    _max_overflow = DB_MAX_OVERFLOW
+
+    def __init__(self, pool_size=None, max_overflow=None):
         _database_url = f'{DB_ENGINE}://{DB_USERNAME}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}'
-        self.engine = create_engine(_database_url, future=True)
+        self.engine = create_engine(
+            _database_url, future=True, pool_pre_ping=True,
+            pool_size=pool_size or self._pool_size,
+            max_overflow=self._max_overflow if max_overflow is None else max_overflow
+        )
         self.metadata = MetaData()
         self.metadata.reflect(bind=self.engine, schema='public')
+
+    @classmethod
+    def configure(cls, pool_size=None, max_overflow=None):
+        """
+        设置进程共享连接池大小, 需在首次调用 shared() 之前设置
+        :param pool_size: 常驻连接数, 一般与工作线程数一致
+        :param max_overflow: 突发时允许额外创建的连接数
+        :return:
+        """
+        if pool_size:
+            cls._pool_size = pool_size
+        if max_overflow is not None:
+            cls._max_overflow = max_overflow
+
+    @classmethod
+    def shared(cls):
+        """
+        进程内共享的 Database, engine 与反射得到的表结构只创建一次;
+        fork 出的子进程会重新创建, 不复用父进程的连接
+        :return:
+        """
+        if cls._shared is None or cls._shared_pid != os.getpid():
+            with cls._lock:
+                if cls._shared is None or cls._shared_pid != os.getpid():
+                    cls._shared = cls()
+                    cls._shared_pid = os.getpid()
+        return cls._shared
+
+    def table(self, name='data', schema='public'):
+        """已反射的表"""
+        return self.metadata.tables[f'{schema}.{name}']
@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+发布时间提取
+DATETIME_REGEXES 中的格式按原有优先级合并为一个预编译的正则, 每段文本只扫描一次;
+常见格式直接构造 datetime, 两位年份、"时分" 等其余格式才交给 dateparser, 结果做缓存.
+"""
+import re
+from datetime import datetime
+from functools import lru_cache
+
+_SEP = r'[-|/|.]'
+_DATES = [
+    ('ymd', rf'(?P<y>\d{{4}}){_SEP}(?P<m>\d{{1,2}}){_SEP}(?P<d>\d{{1,2}})'),
+    ('yy', rf'\d{{2}}{_SEP}\d{{1,2}}{_SEP}\d{{1,2}}'),
+    ('ymd', r'(?P<y>\d{4})年(?P<m>\d{1,2})月(?P<d>\d{1,2})日'),
+    ('yy', r'\d{2}年\d{1,2}月\d{1,2}日'),
+    ('md', r'(?P<m>\d{1,2})月(?P<d>\d{1,2})日'),
+]
+_TIMES = [
+    r'\s*?(?P<H>[0-1]?[0-9]):(?P<M>[0-5]?[0-9]):(?P<S>[0-5]?[0-9])',
+    r'\s*?(?P<H>[2][0-3]):(?P<M>[0-5]?[0-9]):(?P<S>[0-5]?[0-9])',
+    r'\s*?(?P<H>[0-1]?[0-9]):(?P<M>[0-5]?[0-9])',
+    r'\s*?(?P<H>[2][0-3]):(?P<M>[0-5]?[0-9])',
+]
+_CN_TIME = r'\s*?[1-24]\d时[0-60]\d分'
+_CN_TIME_TAIL = r'[1-24]\d时'
+
+
+def _formats():
+    """
+    与 DATETIME_REGEXES 一一对应、顺序一致的格式
+    :return: [(kind, pattern)], kind 为 dateparser 时按原逻辑解析 text 分组
+    """
+    formats = list()
+    for kind, date in _DATES:
+        for time in _TIMES:
+            formats.append((kind, date + time))
+        formats.append(('dateparser', rf'(?P<text>{re.sub(r"[(][?]P<[a-z]+>", "(?:", date)}{_CN_TIME})'
+                                      rf'{_CN_TIME_TAIL}'))
+    for kind, date in _DATES:
+        formats.append((kind, date))
+    return formats
+
+
+FORMATS = _formats()
+DATETIME_PATTERN = re.compile('|'.join(
+    '(?P<f{}>{})'.format(idx, pattern.replace('(?P<', f'(?P<f{idx}_'))
+    for idx, (kind, pattern) in enumerate(FORMATS)
+))
+
+
+def _parse(text):
+    import dateparser
+    return dateparser.parse(text)
+
+
+def _build(idx, match):
+    kind = FORMATS[idx][0]
+    group = match.groupdict()
+    prefix = f'f{idx}_'
+    fields = {key[len(prefix):]: value for key, value in group.items() if key.startswith(prefix) and value}
+    if kind == 'dateparser':
+        return _parse(fields['text'])
+    if kind == 'yy':
+        return _parse(match.group(f'f{idx}'))
+    year = int(fields['y']) if kind == 'ymd' else datetime.now().year
+    try:
+        return datetime(year, int(fields['m']), int(fields['d']),
+                        int(fields.get('H', 0)), int(fields.get('M', 0)), int(fields.get('S', 0)))
+    except ValueError:
+        # 月、日越界, dateparser 同样无法解析
+        return None
+
+
+@lru_cache(maxsize=4096)
+def extract_datetime(text):
+    """
+    从文本中提取发布时间, 多个格式同时出现时取 DATETIME_REGEXES 中靠前的格式
+    :param text:
+    :return: datetime, 未匹配到时返回 None
+    """
+    if not text:
+        return None
+    best = None
+    for match in DATETIME_PATTERN.finditer(text):
+        idx = int(match.lastgroup[1:])
+        if best is None or idx < best[0]:
+            best = (idx, match)
+            if idx == 0:
+                break
+    if best is None:
+        return None
+    return _build(*best)
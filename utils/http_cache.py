@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import json
+import hashlib
+import threading
+from pathlib import Path
+from urllib.parse import urlencode
+from loguru import logger
+
+_caches = dict()
+_caches_lock = threading.Lock()
+
+
+def get_validator_cache(path):
+    """同一文件在进程内只创建一个 ValidatorCache"""
+    path = Path(path)
+    with _caches_lock:
+        if path not in _caches:
+            _caches[path] = ValidatorCache(path)
+        return _caches[path]
+
+
+class ValidatorCache(object):
+    """
+    HTTP 校验缓存
+    按 url + params 记录 ETag、Last-Modified 与响应体 sha256, 再次请求时带上 If-None-Match / If-Modified-Since;
+    服务端返回 304 或响应体哈希不变时视为未变化.
+    新的校验值在 commit(key) 之后才落盘, 处理失败的来源下次仍会完整处理.
+    """
+    def __init__(self, path):
+        self.path = Path(path)
+        self._entries = dict()
+        self._pending = dict()
+        self._lock = threading.Lock()
+        if self.path.exists():
+            try:
+                with open(self.path, 'r', encoding='utf-8') as f:
+                    self._entries = json.load(f)
+            except Exception:
+                logger.warning(f"http cache broken, ignored: {self.path}")
+
+    @staticmethod
+    def key(url, params=None):
+        """缓存键只保存哈希, params 中的 token、key 等凭据不落盘"""
+        raw = url if not params else f"{url}?{urlencode(sorted(params.items()))}"
+        return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+    def get(self, session, url, params=None, headers=None, **kwargs):
+        """
+        条件请求
+        :param session:
+        :param url:
+        :param params:
+        :param headers:
+        :param kwargs: 透传给 session.get
+        :return: (resp, changed), 返回 304 时 resp 没有响应体
+        """
+        key = self.key(url, params)
+        entry = self._entries.get(key) or dict()
+        headers = dict(headers or {})
+        if entry.get('etag'):
+            headers['If-None-Match'] = entry['etag']
+        if entry.get('last_modified'):
+            headers['If-Modified-Since'] = entry['last_modified']
+        resp = session.get(url, params=params, headers=headers, **kwargs)
+        if resp.status_code == 304:
+            return resp, False
+        resp.raise_for_status()
+        digest = hashlib.sha256(resp.content).hexdigest()
+        with self._lock:
+            self._pending[key] = {
+                'etag': resp.headers.get('ETag'),
+                'last_modified': resp.headers.get('Last-Modified'),
+                'sha256': digest
+            }
+        return resp, entry.get('sha256') != digest
+
+    def commit(self, key):
+        """来源处理成功后保存其校验值"""
+        with self._lock:
+            entry = self._pending.pop(key, None)
+            if entry is None:
+                return
+            self._entries[key] = entry
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = self.path.with_suffix('.tmp')
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(self._entries, f)
+            tmp_path.replace(self.path)
@@ -0,0 +1,247 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+多节点共享的任务表
+每个已注册的来源(公众号 biz、政府网站栏目)是 public.crawl_job 中的一行. 工作进程用 FOR UPDATE SKIP LOCKED 领取任务,
+同一任务同时只被一个工作进程持有; 持有期间由心跳线程续租, 进程崩溃后租约过期, 任务可被其他工作进程重新领取.
+一轮抓取: enqueue 把不在运行中的任务重置为 pending, 任意数量的工作进程随后领取直到没有可领取的任务.
+"""
+import os
+import uuid
+import socket
+import threading
+import traceback
+from contextlib import contextmanager
+from collections import namedtuple
+from loguru import logger
+from sqlalchemy import text
+from utils.settings import JOB_LEASE, JOB_MAX_ATTEMPTS, JOB_RETRY_DELAY
+
+Job = namedtuple('Job', ['name', 'kind', 'title', 'attempts'])
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS public.crawl_job (
+    name text PRIMARY KEY,
+    kind text NOT NULL,
+    title text,
+    status text NOT NULL DEFAULT 'pending',
+    owner text,
+    attempts integer NOT NULL DEFAULT 0,
+    run_after timestamptz NOT NULL DEFAULT now(),
+    leased_until timestamptz,
+    heartbeat_at timestamptz,
+    started_at timestamptz,
+    finished_at timestamptz,
+    last_error text,
+    updated_at timestamptz NOT NULL DEFAULT now()
+);
+CREATE INDEX IF NOT EXISTS crawl_job_claim_idx ON public.crawl_job (status, run_after)
+"""
+# 多个节点同时建表时串行执行 CREATE TABLE IF NOT EXISTS
+SCHEMA_LOCK = 0x6a6f6273
+
+CLAIM = """
+UPDATE public.crawl_job AS j
+SET status = 'running', owner = :owner, attempts = j.attempts + 1, started_at = now(), heartbeat_at = now(),
+    leased_until = now() + make_interval(secs => :lease), updated_at = now()
+FROM (
+    SELECT name FROM public.crawl_job
+    WHERE kind = ANY(:kinds) AND name = ANY(:names)
+      AND ((status = 'pending' AND run_after <= now()) OR (status = 'running' AND leased_until < now()))
+    ORDER BY run_after, name
+    LIMIT 1
+    FOR UPDATE SKIP LOCKED
+) AS c
+WHERE j.name = c.name
+RETURNING j.name, j.kind, j.title, j.attempts
+"""
+
+
+def worker_id():
+    """<主机名>:<进程号>:<随机串>"""
+    return f'{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}'
+
+
+class JobQueue(object):
+    def __init__(self, db, owner=None, lease=JOB_LEASE, max_attempts=JOB_MAX_ATTEMPTS, retry_delay=JOB_RETRY_DELAY):
+        """
+        :param db: Database
+        :param owner: 工作进程标识, 写入 owner 列
+        :param lease: 租约秒数, 心跳每 lease / 3 秒续租一次
+        :param max_attempts: 连续失败(含租约过期)多少次后标记为 failed
+        :param retry_delay: 失败后重试的间隔秒数, 按已尝试次数递增
+        """
+        self.db = db
+        self.owner = owner or worker_id()
+        self.lease = lease
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+
+    def ensure(self):
+        """建表"""
+        with self.db.engine.begin() as conn:
+            conn.execute(text('SELECT pg_advisory_xact_lock(:key)'), {'key': SCHEMA_LOCK})
+            for statement in SCHEMA.split(';'):
+                conn.execute(text(statement))
+
+    def enqueue(self, entries):
+        """
+        登记来源并开始新一轮: 新来源插入, 已有的不在运行中的来源重置为 pending
+        :param entries: 注册表中的 SpiderEntry
+        :return: 重置或插入的任务数
+        """
+        rows = [{'name': entry.name, 'kind': entry.kind, 'title': entry.title} for entry in entries]
+        if not rows:
+            return 0
+        with self.db.engine.begin() as conn:
+            result = conn.execute(text("""
+                INSERT INTO public.crawl_job (name, kind, title) VALUES (:name, :kind, :title)
+                ON CONFLICT (name) DO UPDATE
+                SET kind = excluded.kind, title = excluded.title, status = 'pending', owner = NULL, attempts = 0,
+                    run_after = now(), last_error = NULL, updated_at = now()
+                WHERE crawl_job.status <> 'running' OR crawl_job.leased_until < now()
+            """), rows)
+        return result.rowcount
+
+    def reap(self):
+        """租约过期且已达到最大尝试次数的任务标记为 failed, 不再领取"""
+        with self.db.engine.begin() as conn:
+            result = conn.execute(text("""
+                UPDATE public.crawl_job
+                SET status = 'failed', owner = NULL, finished_at = now(), updated_at = now(),
+                    last_error = coalesce(last_error, 'lease expired')
+                WHERE status = 'running' AND leased_until < now() AND attempts >= :max_attempts
+            """), {'max_attempts': self.max_attempts})
+        return result.rowcount
+
+    def claim(self, kinds, names):
+        """
+        领取一个任务: pending 且到了重试时间的, 或租约已过期的(持有者已崩溃)
+        :param kinds: 本工作线程可执行的类型
+        :param names: 本进程已注册的来源
+        :return: Job, 没有可领取的任务时为 None
+        """
+        self.reap()
+        with self.db.engine.begin() as conn:
+            row = conn.execute(text(CLAIM), {
+                'owner': self.owner, 'lease': self.lease, 'kinds': list(kinds), 'names': list(names)
+            }).first()
+        return Job(*row) if row else None
+
+    def heartbeat(self, job):
+        """
+        续租
+        :return: 仍持有该任务
+        """
+        with self.db.engine.begin() as conn:
+            result = conn.execute(text("""
+                UPDATE public.crawl_job
+                SET leased_until = now() + make_interval(secs => :lease), heartbeat_at = now(), updated_at = now()
+                WHERE name = :name AND owner = :owner AND status = 'running'
+            """), {'name': job.name, 'owner': self.owner, 'lease': self.lease})
+        return result.rowcount == 1
+
+    def complete(self, job):
+        return self._finish(job, """
+            UPDATE public.crawl_job
+            SET status = 'done', owner = NULL, leased_until = NULL, finished_at = now(), last_error = NULL,
+                updated_at = now()
+            WHERE name = :name AND owner = :owner
+        """)
+
+    def fail(self, job, error):
+        """失败: 未达到最大尝试次数时延后重试, 否则标记为 failed"""
+        return self._finish(job, """
+            UPDATE public.crawl_job
+            SET status = CASE WHEN attempts >= :max_attempts THEN 'failed' ELSE 'pending' END,
+                run_after = now() + make_interval(secs => :retry_delay * attempts),
+                owner = NULL, leased_until = NULL, finished_at = now(), last_error = :error, updated_at = now()
+            WHERE name = :name AND owner = :owner
+        """, max_attempts=self.max_attempts, retry_delay=self.retry_delay, error=str(error)[-4000:])
+
+    def release(self, job):
+        """退出时归还未完成的任务, 不计入尝试次数"""
+        return self._finish(job, """
+            UPDATE public.crawl_job
+            SET status = 'pending', attempts = greatest(attempts - 1, 0), owner = NULL, leased_until = NULL,
+                updated_at = now()
+            WHERE name = :name AND owner = :owner
+        """)
+
+    def _finish(self, job, statement, **params):
+        """
+        :return: False 表示租约已失效, 任务已被其他工作进程领取
+        """
+        with self.db.engine.begin() as conn:
+            result = conn.execute(text(statement), dict(params, name=job.name, owner=self.owner))
+        if result.rowcount != 1:
+            logger.warning(f"Job lease lost before finish: {job.name}")
+            return False
+        return True
+
+    @contextmanager
+    def leased(self, job):
+        """持有任务期间后台续租"""
+        stop = threading.Event()
+
+        def _beat():
+            while not stop.wait(max(self.lease / 3, 1)):
+                try:
+                    if not self.heartbeat(job):
+                        logger.warning(f"Job lease lost: {job.name}, owner: {self.owner}")
+                        return
+                except Exception:
+                    logger.warning(f"Job heartbeat failed: {job.name}\n{traceback.format_exc()}")
+
+        thread = threading.Thread(target=_beat, name=f'heartbeat-{job.name}', daemon=True)
+        thread.start()
+        try:
+            yield job
+        finally:
+            stop.set()
+            thread.join()
+
+    def work(self, execute, kinds, names, stop=None, wait=0):
+        """
+        循环领取并执行任务, 直到没有可领取的任务或 stop 被设置
+        :param execute: execute(job), 返回 True 时任务完成, 其他返回值或异常计为失败
+        :param kinds:
+        :param names:
+        :param stop: threading.Event
+        :param wait: 没有可领取的任务时等待的秒数后重试, 0 时直接返回
+        :return: 执行的任务数
+        """
+        stop = stop or threading.Event()
+        done = 0
+        while not stop.is_set():
+            job = self.claim(kinds, names)
+            if job is None:
+                if not wait:
+                    break
+                stop.wait(wait)
+                continue
+            logger.info(f"Job claimed: {job.name} [{job.title}], attempt: {job.attempts}, owner: {self.owner}")
+            with self.leased(job):
+                try:
+                    ok, error = execute(job) is True, 'handler reported failure'
+                except Exception:
+                    ok, error = False, traceback.format_exc()
+            if ok:
+                self.complete(job)
+            elif stop.is_set():
+                self.release(job)
+            else:
+                logger.error(f"Job failed: {job.name}, attempt: {job.attempts}")
+                self.fail(job, error)
+            done += 1
+        return done
+
+    def summary(self, names=None):
+        """各状态的任务数"""
+        with self.db.engine.connect() as conn:
+            rows = conn.execute(text("""
+                SELECT status, count(*) FROM public.crawl_job
+                WHERE :all_names OR name = ANY(:names)
+                GROUP BY status
+            """), {'all_names': names is None, 'names': list(names or [])}).all()
+        return {status: count for status, count in rows}
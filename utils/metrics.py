@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+运行指标
+按阶段(list、detail_http、detail_browser、parse、download、screenshot、save_page 等)、站点、公众号记录耗时直方图,
+按状态(fetched、duplicate、invalid、stored、conflict)记录条数;
+运行结束时写出 Prometheus 文本格式(metrics.prom, 可供 node_exporter textfile 采集)与 JSON 汇总(metrics.json).
+"""
+import json
+import time
+import bisect
+import threading
+from pathlib import Path
+from datetime import datetime
+from contextlib import contextmanager
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+HELP = {
+    'spider_stage_seconds': 'Latency of each crawl stage',
+    'spider_records_total': 'Records by status',
+}
+
+
+def _labels(labels):
+    return tuple(sorted((key, '' if value is None else str(value)) for key, value in labels.items()))
+
+
+def _format_labels(labels, **extra):
+    items = list(labels) + list(extra.items())
+    if not items:
+        return ''
+    escaped = ('{}="{}"'.format(key, value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+               for key, value in items)
+    return '{' + ','.join(escaped) + '}'
+
+
+class Metrics(object):
+    """进程内的计数器与直方图, 线程安全"""
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = tuple(buckets)
+        self.started = datetime.now()
+        self._counters = dict()
+        self._histograms = dict()
+        self._lock = threading.Lock()
+
+    def inc(self, name, value=1, **labels):
+        if not value:
+            return
+        key = (name, _labels(labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name, seconds, **labels):
+        key = (name, _labels(labels))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = {'buckets': [0] * len(self.buckets), 'count': 0, 'sum': 0.0,
+                                                     'max': 0.0}
+            idx = bisect.bisect_left(self.buckets, seconds)
+            if idx < len(self.buckets):
+                histogram['buckets'][idx] += 1
+            histogram['count'] += 1
+            histogram['sum'] += seconds
+            histogram['max'] = max(histogram['max'], seconds)
+
+    @contextmanager
+    def timer(self, name, **labels):
+        """记录 with 块的耗时(异常时同样记录)"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def prometheus(self):
+        """Prometheus 文本格式"""
+        with self._lock:
+            counters = sorted(self._counters.items())
+            histograms = sorted(self._histograms.items())
+        lines = list()
+        typed = set()
+
+        def _header(name, kind):
+            if name not in typed:
+                typed.add(name)
+                lines.append(f'# HELP {name} {HELP.get(name, name)}')
+                lines.append(f'# TYPE {name} {kind}')
+
+        for (name, labels), value in counters:
+            _header(name, 'counter')
+            lines.append(f'{name}{_format_labels(labels)} {value}')
+        for (name, labels), histogram in histograms:
+            _header(name, 'histogram')
+            cumulative = 0
+            for bound, count in zip(self.buckets, histogram['buckets']):
+                cumulative += count
+                lines.append(f'{name}_bucket{_format_labels(labels, le=str(bound))} {cumulative}')
+            lines.append(f'{name}_bucket{_format_labels(labels, le="+Inf")} {histogram["count"]}')
+            lines.append(f'{name}_sum{_format_labels(labels)} {histogram["sum"]:.6f}')
+            lines.append(f'{name}_count{_format_labels(labels)} {histogram["count"]}')
+        return '\n'.join(lines) + '\n'
+
+    def summary(self):
+        """JSON 汇总"""
+        with self._lock:
+            counters = [{'name': name, 'labels': dict(labels), 'value': value}
+                        for (name, labels), value in sorted(self._counters.items())]
+            histograms = [{
+                'name': name, 'labels': dict(labels), 'count': histogram['count'],
+                'sum': round(histogram['sum'], 6), 'mean': round(histogram['sum'] / histogram['count'], 6),
+                'max': round(histogram['max'], 6)
+            } for (name, labels), histogram in sorted(self._histograms.items())]
+        return {
+            'started': self.started.isoformat(timespec='seconds'),
+            'finished': datetime.now().isoformat(timespec='seconds'),
+            'counters': counters,
+            'histograms': histograms
+        }
+
+    def write(self, path, name='metrics'):
+        """
+        写出 <path>/<name>.prom 与 <path>/<name>.json
+        :param path: 日志目录
+        :param name:
+        :return:
+        """
+        path = Path(path)
+        path.mkdir(parents=True, exist_ok=True)
+        for suffix, text in (('.prom', self.prometheus()),
+                             ('.json', json.dumps(self.summary(), ensure_ascii=False, indent=2))):
+            target = path / f'{name}{suffix}'
+            tmp_path = target.with_suffix(target.suffix + '.tmp')
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                f.write(text)
+            tmp_path.replace(target)
+
+
+metrics = Metrics()
@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+单个来源的 CPU 与内存分析
+cProfile 只统计调用它的线程(即该来源的任务线程); tracemalloc 是进程级的,
+多个来源并发运行时内存差异中也包含其他线程的分配, 需要精确结果时单独运行该来源.
+Python 3.12 起 cProfile 基于进程级的 sys.monitoring, 同时只能启用一个 Profile:
+此时并发的来源中只有先开始的一个记录 CPU 统计, 其余只记录内存并在日志中说明.
+"""
+import re
+import io
+import sys
+import pstats
+import cProfile
+import threading
+import tracemalloc
+from pathlib import Path
+from contextlib import contextmanager
+from loguru import logger
+
+_tracing = 0
+_tracing_started = False  # tracemalloc 由本模块启动, 在此之前已启动的不由本模块停止
+_tracing_lock = threading.Lock()
+SINGLE_PROFILER = sys.version_info >= (3, 12)
+_profiler_lock = threading.Lock()
+
+
+def _start_tracing():
+    global _tracing, _tracing_started
+    with _tracing_lock:
+        if _tracing == 0 and not tracemalloc.is_tracing():
+            tracemalloc.start(10)
+            _tracing_started = True
+        _tracing += 1
+
+
+def _stop_tracing():
+    global _tracing, _tracing_started
+    with _tracing_lock:
+        _tracing -= 1
+        if _tracing == 0 and _tracing_started:
+            tracemalloc.stop()
+            _tracing_started = False
+
+
+def _start_profiler(name):
+    """
+    :return: 已启用的 Profile; 已有其他分析器启用时为 None
+    """
+    if SINGLE_PROFILER and not _profiler_lock.acquire(blocking=False):
+        logger.warning(f"cProfile skipped for {name}: Python {sys.version_info.major}.{sys.version_info.minor} "
+                       f"allows only one active profiler per process and another source is being profiled, "
+                       f"run this source alone (--only) for CPU stats")
+        return None
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError as e:
+        logger.warning(f"cProfile skipped for {name}: {e}")
+        if SINGLE_PROFILER:
+            _profiler_lock.release()
+        return None
+    return profiler
+
+
+def _stop_profiler(profiler):
+    if profiler is None:
+        return
+    profiler.disable()
+    if SINGLE_PROFILER:
+        _profiler_lock.release()
+
+
+def safe_name(name):
+    return re.sub(r'[\\/:*?"<>|\s]+', '_', str(name)).strip('_') or 'task'
+
+
+@contextmanager
+def profiled(name, path, enabled=True, top=30):
+    """
+    记录 with 块的 cProfile 统计与 tracemalloc 内存差异
+    写出 <path>/profile/<name>.prof(可用 snakeviz / pstats 查看)与 <name>.txt(耗时最多的函数、分配最多的位置)
+    :param name: 来源名称
+    :param path: 日志目录
+    :param enabled: False 时不做任何事
+    :param top: 文本报告中的条数
+    :return:
+    """
+    if not enabled:
+        yield
+        return
+    _start_tracing()
+    before = tracemalloc.take_snapshot()
+    profiler = _start_profiler(name)
+    try:
+        yield
+    finally:
+        _stop_profiler(profiler)
+        after = tracemalloc.take_snapshot()
+        current, peak = tracemalloc.get_traced_memory()
+        _stop_tracing()
+        try:
+            _write(safe_name(name), Path(path) / 'profile', profiler, before, after, peak, top)
+        except Exception:
+            logger.exception(f"write profile failed: {name}")
+
+
+def _write(name, path, profiler, before, after, peak, top):
+    path.mkdir(parents=True, exist_ok=True)
+    stream = io.StringIO()
+    if profiler is not None:
+        profiler.dump_stats(path / f'{name}.prof')
+        stats = pstats.Stats(profiler, stream=stream)
+        stats.sort_stats('cumulative').print_stats(top)
+        stats.sort_stats('tottime').print_stats(top)
+    else:
+        stream.write('cProfile skipped: another profiler was active\n')
+
+    filters = [tracemalloc.Filter(False, tracemalloc.__file__),
+               tracemalloc.Filter(False, '<frozen importlib._bootstrap>')]
+    diff = after.filter_traces(filters).compare_to(before.filter_traces(filters), 'lineno')
+    stream.write(f'\nTop {top} allocation sites (growth during the task), traced peak: {peak / 1024 / 1024:.1f} MiB\n')
+    for stat in diff[:top]:
+        stream.write(f'{stat}\n')
+    with open(path / f'{name}.txt', 'w', encoding='utf-8') as f:
+        f.write(stream.getvalue())
+    logger.info(f"Profile written: {path / name}.{'prof' if profiler is not None else 'txt'}")
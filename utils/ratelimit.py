@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+接口限流
+每个 host + 凭据共享一个令牌桶(进程内), 接口返回限流/错误码时速率减半, 连续成功后逐步恢复;
+jzl 等按次计费的接口按凭据在数据库中记录每日调用次数(public.crawl_quota, 多个工作进程/节点共享), 超出预算时不再请求;
+相同的请求同时只发出一次, 其余调用方等待并共享结果.
+"""
+import time
+import hashlib
+import threading
+from loguru import logger
+from sqlalchemy import text
+
+_limiters = dict()
+_quotas = dict()
+_registry_lock = threading.Lock()
+
+
+class QuotaExceeded(RuntimeError):
+    pass
+
+
+def credential_key(host, credential):
+    """凭据只以哈希形式出现在键、日志与文件中"""
+    digest = hashlib.sha256(str(credential).encode('utf-8')).hexdigest()[:16] if credential else '-'
+    return f'{host}#{digest}'
+
+
+def get_limiter(key, rate=1.0, burst=1, min_rate=None):
+    """同一 host + 凭据在进程内只创建一个 RateLimiter"""
+    with _registry_lock:
+        if key not in _limiters:
+            _limiters[key] = RateLimiter(key, rate=rate, burst=burst, min_rate=min_rate)
+        return _limiters[key]
+
+
+def get_quota(db, key, limit):
+    """同一凭据在进程内只创建一个 DailyQuota"""
+    with _registry_lock:
+        if key not in _quotas:
+            _quotas[key] = DailyQuota(db, key, limit)
+        return _quotas[key]
+
+
+class RateLimiter(object):
+    """
+    令牌桶 + 自适应退避(AIMD)
+    acquire 按当前速率发放令牌; penalize 使速率减半(不低于 min_rate), reward 每次成功恢复 10% 的初始速率
+    """
+    def __init__(self, key, rate=1.0, burst=1, min_rate=None):
+        self.key = key
+        self.max_rate = float(rate)
+        self.min_rate = float(min_rate) if min_rate else self.max_rate / 16
+        self.rate = self.max_rate
+        self.burst = max(float(burst), 1.0)
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """阻塞到取得一个令牌"""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+    def penalize(self, reason=None):
+        with self._lock:
+            self.rate = max(self.min_rate, self.rate / 2)
+            self._tokens = min(self._tokens, 0)
+        logger.warning(f"[{self.key}] backoff ({reason}), rate: {self.rate:.3f}/s")
+
+    def reward(self):
+        with self._lock:
+            self.rate = min(self.max_rate, self.rate + self.max_rate / 10)
+
+
+class DailyQuota(object):
+    """
+    按凭据记录的每日调用次数, 保存在 public.crawl_quota (key, day, used)
+    每次请求前用一条 INSERT ... ON CONFLICT DO UPDATE ... RETURNING 原子地占用额度, 多个工作进程/节点共享同一预算;
+    日期取数据库的 current_date. limit 为 0 或 None 时不限制, 也不访问数据库
+    """
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS public.crawl_quota (
+        key text NOT NULL,
+        day date NOT NULL DEFAULT current_date,
+        used integer NOT NULL DEFAULT 0,
+        PRIMARY KEY (key, day)
+    )
+    """
+    # 多个节点同时建表时串行执行 CREATE TABLE IF NOT EXISTS
+    SCHEMA_LOCK = 0x71756f74
+
+    def __init__(self, db, key, limit):
+        """
+        :param db: Database
+        :param key: credential_key, 凭据只以哈希形式保存
+        :param limit: 每日调用次数上限
+        """
+        self.db = db
+        self.key = key
+        self.limit = int(limit or 0)
+        self.used = 0
+        if self.limit:
+            self.ensure()
+
+    def ensure(self):
+        """建表"""
+        with self.db.engine.begin() as conn:
+            conn.execute(text('SELECT pg_advisory_xact_lock(:key)'), {'key': self.SCHEMA_LOCK})
+            conn.execute(text(self.SCHEMA))
+
+    @property
+    def remaining(self):
+        return max(self.limit - self.used, 0) if self.limit else None
+
+    def reserve(self):
+        """
+        请求前占用一次额度, 额度已用完时抛出 QuotaExceeded
+        :return:
+        """
+        if not self.limit:
+            return
+        with self.db.engine.begin() as conn:
+            used = conn.execute(text("""
+                INSERT INTO public.crawl_quota AS q (key, day, used) VALUES (:key, current_date, 1)
+                ON CONFLICT (key, day) DO UPDATE SET used = q.used + 1
+                WHERE q.used < :limit
+                RETURNING q.used
+            """), {'key': self.key, 'limit': self.limit}).scalar()
+        if used is None:
+            self.used = self.limit
+            raise QuotaExceeded(f"[{self.key}] daily quota exhausted: {self.limit}/{self.limit}")
+        self.used = used
+
+
+class SingleFlight(object):
+    """相同 key 的调用同时只执行一次, 等待中的调用方得到同一结果(或同一异常)"""
+    def __init__(self):
+        self._calls = dict()
+        self._lock = threading.Lock()
+
+    def do(self, key, func, *args, **kwargs):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = {'event': threading.Event(), 'result': None, 'error': None}
+        if not leader:
+            call['event'].wait()
+            if call['error'] is not None:
+                raise call['error']
+            return call['result']
+        try:
+            call['result'] = func(*args, **kwargs)
+            return call['result']
+        except Exception as e:
+            call['error'] = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call['event'].set()
+
+
+single_flight = SingleFlight()
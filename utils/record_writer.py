@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import time
+import queue
+import threading
+import traceback
+from loguru import logger
+from utils.settings import DB_BATCH_SIZE, WRITER_FLUSH_INTERVAL, WRITER_QUEUE_SIZE, WRITER_RETRY_MAX, \
+    WRITER_MAX_BATCH
+
+_CLOSE = object()
+
+
+class RecordWriter(object):
+    """
+    后台入库线程
+    爬虫边抓取边 put 记录, 写入线程攒够 batch_size 条或距上次写入超过 flush_interval 秒时批量写入;
+    写入时连同队列中已积压的记录一起交给 save(最多 max_batch 条): 平时每批约 batch_size 条走多行 INSERT,
+    写入跟不上抓取时积压的记录合成大批, 达到 DB_COPY_THRESHOLD 时 save_page 改用 COPY.
+    队列有界, 写入跟不上时 put 阻塞, 抓取随之放慢; close 时写完队列中剩余的记录.
+    写入失败时不再从队列取记录(队列满后抓取随之暂停), 按 1、2、4 ... 秒(最多 retry_max 秒)退避后重试失败的批次;
+    close 时仍失败的记录计入 failed.
+    """
+    def __init__(self, save, batch_size=DB_BATCH_SIZE, flush_interval=WRITER_FLUSH_INTERVAL,
+                 max_queue=WRITER_QUEUE_SIZE, max_batch=WRITER_MAX_BATCH, retry_max=WRITER_RETRY_MAX,
+                 name='record-writer'):
+        """
+        :param save: 批量写入函数, save(records)
+        :param batch_size:
+        :param flush_interval: 秒
+        :param max_queue: 队列中最多等待写入的记录数
+        :param max_batch: 单次 save 的记录数上限
+        :param retry_max: 写入失败后重试的最长间隔, 秒
+        :param name: 线程名
+        """
+        self.save = save
+        self.batch_size = max(int(batch_size), 1)
+        self.max_batch = max(int(max_batch), self.batch_size)
+        self.flush_interval = flush_interval
+        self.retry_max = retry_max
+        self.queue = queue.Queue(maxsize=max(int(max_queue), 1))
+        self.written = 0
+        self.failed = 0
+        self._pending = list()
+        self._retry_delay = 0
+        self._closed = False
+        self._closing = threading.Event()
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+
+    def put(self, record):
+        """加入写入队列, 队列满时阻塞"""
+        if self._closed:
+            raise RuntimeError("record writer closed")
+        self.queue.put(record)
+
+    def put_many(self, records):
+        for record in records:
+            self.put(record)
+
+    def _run(self):
+        deadline = time.monotonic() + self.flush_interval
+        while True:
+            if self._retry_delay:
+                # 上次写入失败: 不取新记录, 退避后重试, close 时提前结束等待
+                if self._closing.wait(self._retry_delay):
+                    break
+                self._flush()
+                deadline = time.monotonic() + self.flush_interval
+                continue
+            try:
+                item = self.queue.get(timeout=max(deadline - time.monotonic(), 0.01))
+            except queue.Empty:
+                item = None
+            if item is _CLOSE:
+                break
+            if item is not None:
+                self._pending.append(item)
+            elif self._closing.is_set():
+                break
+            if len(self._pending) >= self.batch_size or time.monotonic() >= deadline:
+                self._drain(self.max_batch)
+                self._flush()
+                deadline = time.monotonic() + self.flush_interval
+        self._drain()
+        self._flush(final=True)
+
+    def _drain(self, limit=None):
+        """取出队列中已积压的记录, limit 为 pending 的上限; close 时取出全部"""
+        while limit is None or len(self._pending) < limit:
+            try:
+                item = self.queue.get_nowait()
+            except queue.Empty:
+                return
+            if item is not _CLOSE:
+                self._pending.append(item)
+
+    def _flush(self, final=False):
+        while self._pending:
+            batch = self._pending[:self.max_batch]
+            try:
+                self.save(batch)
+            except Exception:
+                logger.error(f"save records failed ({len(batch)}): {traceback.format_exc()}")
+                if final:
+                    self.failed += len(self._pending)
+                    self._pending.clear()
+                    return
+                self._retry_delay = min(self._retry_delay * 2 or 1, self.retry_max)
+                logger.warning(f"record writer paused, retry in {self._retry_delay}s, pending: {len(self._pending)}")
+                return
+            del self._pending[:len(batch)]
+            self.written += len(batch)
+        self._retry_delay = 0
+
+    def close(self):
+        """
+        写完剩余记录并结束写入线程
+        :return: 全部记录是否写入成功
+        """
+        if not self._closed:
+            self._closed = True
+            self._closing.set()
+            try:
+                self.queue.put_nowait(_CLOSE)
+            except queue.Full:
+                # 写入线程在退避中或队列已满, _closing 会让它结束等待并取出剩余记录
+                pass
+            self._thread.join()
+        return self.failed == 0
@@ -11,6 +11,25 @@ DB_PORT = 56000
 DB_NAME = 'postgres'
 DB_USERNAME = 'postgres'
 DB_PASSWORD = 'pPePFjqM'
+DB_POOL_SIZE = 10  # 进程共享连接池常驻连接数, 多线程运行时按线程数设置
+DB_MAX_OVERFLOW = 5
+DB_BATCH_SIZE = 500  # save_page 每条多行 INSERT 的记录数
+DB_COPY_THRESHOLD = 2000  # save_page 记录数达到该值时改用 COPY; 后台入库积压(写入跟不上抓取)时一次写入的记录数可达到该值
+WRITER_FLUSH_INTERVAL = 5  # 后台入库线程距上次写入超过该秒数时写入已攒的记录
+WRITER_QUEUE_SIZE = 2000  # 后台入库队列长度, 写入跟不上时抓取阻塞
+WRITER_MAX_BATCH = 5000  # 后台入库每次写入时连同队列中积压的记录一起写入, 单次最多的记录数
+WRITER_RETRY_MAX = 60  # 后台入库写入失败后按 1、2、4 ... 秒退避重试, 最长间隔秒数
+JOB_LEASE = 300  # 任务表(run.py --jobs)租约秒数, 工作进程每 1/3 租约续租一次, 崩溃后租约过期即可被其他节点领取
+JOB_MAX_ATTEMPTS = 3  # 任务连续失败多少次后标记为 failed
+JOB_RETRY_DELAY = 600  # 任务失败后重试的间隔秒数, 按已尝试次数递增
+ARCHIVE_MODE = False  # 页面与截图追加写入栏目目录下 archive 中的压缩分段文件, 不再为每条记录创建目录
+FETCH_MODE = 'http'  # 政府网站页面获取方式: http(需要渲染时退回浏览器) / browser, 可通过 --fetch 指定
+SCREENSHOT = 'full'  # 详情页截图: off / viewport / full, 抓取结束后用保存的 HTML 补拍, 可通过 --screenshot 指定
+SCREENSHOT_TYPE = 'png'  # 截图格式: png / jpeg(按 SCREENSHOT_QUALITY 压缩, 文件更小)
+SCREENSHOT_QUALITY = 60  # jpeg 质量
+EXTRACT_MODE = 'evaluate'  # 浏览器详情页解析方式: evaluate(一次往返取回页面后本地解析) / dom(逐个元素查询)
+STOP_AFTER_KNOWN = 10  # 增量爬取: 连续遇到多少个已入库链接后停止翻页, --full 时不停止
+DETAIL_CONCURRENCY = 4  # 浏览器爬虫同时打开的详情页数量, 可通过 --concurrency 指定
 FILE_SAVE_PATH = os.path.join(os.path.expandvars('$HOME'), "spider_doc")
 DATETIME_REGEXES = [
     "(\d{4}[-|/|.]\d{1,2}[-|/|.]\d{1,2}\s*?[0-1]?[0-9]:[0-5]?[0-9]:[0-5]?[0-9])",
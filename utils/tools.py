@@ -1,13 +1,19 @@
 import re
+import io
 import os
+import hashlib
+import threading
 import yaml
 import requests
+import requests.adapters
 from loguru import logger
 from pathlib import Path
-from sqlalchemy import exists
-from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy import select, any_, bindparam
+from sqlalchemy.dialects.postgresql import insert, ARRAY
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
 from retrying import retry
+from utils.settings import DB_BATCH_SIZE, DB_COPY_THRESHOLD
 
 
 def convert_to_relative_path(path: Path):
@@ -33,19 +39,132 @@ def generate_path(category_path, basename):
     return record_path, attachment_path
 
 
-def duplicate_filter(db, table, page_url):
+def duplicate_filter_batch(db, table, page_urls, chunk_size=1000):
     """
-    筛选数据库重复link
+    批量筛选数据库重复link, 每批只发一条 `page_url = ANY(...)` 查询
     :param db:
     :param table:
-    :param page_url:
-    :return:
+    :param page_urls: 一个列表页上的全部 link
+    :param chunk_size: 单条查询携带的 link 数量上限
+    :return: 数据库中已存在的 link 集合
     """
+    urls = list(dict.fromkeys(url for url in page_urls if url))
+    existed = set()
+    if not urls:
+        return existed
+    query = select(table.c.page_url).where(
+        table.c.page_url == any_(bindparam('page_urls', type_=ARRAY(table.c.page_url.type)))
+    )
     with db.engine.connect() as conn:
-        with conn.begin():
-            query = exists(table.c.page_url).select().\
-                where(table.c.page_url == page_url)
-            return conn.execute(query).scalar()
+        for i in range(0, len(urls), chunk_size):
+            rows = conn.execute(query, {'page_urls': urls[i:i + chunk_size]})
+            existed.update(row[0] for row in rows)
+    return existed
+
+
+_seen_indexes = dict()
+_seen_indexes_lock = threading.Lock()
+
+
+def get_seen_index(db, table):
+    """同一张表在进程内只加载一次 SeenIndex, 各爬虫共享; 之后入库的 link 由 confirm 按列表页回查补上"""
+    with _seen_indexes_lock:
+        if table.fullname not in _seen_indexes:
+            _seen_indexes[table.fullname] = SeenIndex(db, table)
+        return _seen_indexes[table.fullname]
+
+
+class SeenIndex(object):
+    """
+    已入库 link 的内存索引, 每个进程只从 public.data 加载一次 page_url,
+    之后的判重全部在内存中完成.
+    page_url 在全表唯一, 因此索引覆盖全表而不按站点划分, 其他站点已入库的 link 同样视为重复.
+    每个 link 只保存 64 位 blake2b 摘要, 数万条 link 仅占用数 MB;
+    摘要命中即视为重复, verify=True 时对命中的 link 再批量回查数据库, 排除极小概率的摘要碰撞.
+    """
+    def __init__(self, db, table):
+        self.db = db
+        self.table = table
+        self._digests = set()
+        self._lock = threading.Lock()
+        self.load()
+
+    @staticmethod
+    def _digest(page_url):
+        return int.from_bytes(hashlib.blake2b(page_url.encode('utf-8'), digest_size=8).digest(), 'big')
+
+    def load(self):
+        """从数据库加载全部 page_url"""
+        query = select(self.table.c.page_url)
+        digests = set()
+        with self.db.engine.connect() as conn:
+            result = conn.execution_options(stream_results=True, yield_per=5000).execute(query)
+            for (page_url,) in result:
+                if page_url:
+                    digests.add(self._digest(page_url))
+        with self._lock:
+            self._digests = digests
+        logger.info(f"Seen index loaded: {len(digests)} links")
+
+    def __len__(self):
+        return len(self._digests)
+
+    def __contains__(self, page_url):
+        return bool(page_url) and self._digest(page_url) in self._digests
+
+    def add(self, page_url):
+        """本次运行新产生的 link 加入索引, 同一次运行内不再重复处理"""
+        if page_url:
+            with self._lock:
+                self._digests.add(self._digest(page_url))
+
+    def confirm(self, page_urls):
+        """
+        索引未命中的 link 批量回查数据库, 已入库的加入索引
+        索引只在首次使用时加载, 之后其他工作进程或节点入库的 link 由此补上(一个列表页一条查询)
+        :param page_urls:
+        :return: 回查发现的已入库 link
+        """
+        misses = [url for url in page_urls if url and url not in self]
+        existed = duplicate_filter_batch(self.db, self.table, misses) if misses else set()
+        if existed:
+            with self._lock:
+                self._digests.update(self._digest(url) for url in existed)
+        return existed
+
+    def filter(self, page_urls, verify=False):
+        """
+        批量判重
+        :param page_urls:
+        :param verify: 摘要命中的 link 是否回查数据库确认
+        :return: 未入库的 link 列表(保持原顺序)
+        """
+        maybe = [url for url in page_urls if url in self]
+        if verify and maybe:
+            duplicated = duplicate_filter_batch(self.db, self.table, maybe)
+        else:
+            duplicated = set(maybe)
+        return [url for url in page_urls if url not in duplicated]
+
+
+def html_visible(element):
+    """
+    页面 HTML 中元素是否可见:
+    浏览器中已标记为不可见(data-spider-hidden)的元素为不可见;
+    HTTP 获取的页面近似浏览器 is_visible, 元素及其祖先均没有 hidden 属性、display:none 或 visibility:hidden 内联样式
+    :param element: lxml 元素
+    :return:
+    """
+    if element.get('data-spider-hidden') is not None:
+        return False
+    while element is not None:
+        if element.get('hidden') is not None:
+            return False
+        style = (element.get('style') or '').replace(' ', '').lower()
+        if 'display:none' in style or 'visibility:hidden' in style:
+            return False
+        element = element.getparent()
+    return True
 
 
 def gen_invalid_record(record, category, page_url):
@@ -56,35 +175,225 @@ def gen_invalid_record(record, category, page_url):
     return page_record
 
 
+DOWNLOAD_HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) '
+                  'AppleWebKit/537.36 (KHTML, like Gecko) Chrome/92.0.4515.131 Safari/537.36',
+    'Accept-Encoding': 'identity'
+}
+_download_session = None
+_download_session_lock = threading.Lock()
+
+
+def download_session():
+    """附件下载共用的 session, 同 host 复用连接"""
+    global _download_session
+    if _download_session is None:
+        with _download_session_lock:
+            if _download_session is None:
+                session = requests.session()
+                adapter = requests.adapters.HTTPAdapter(pool_connections=16, pool_maxsize=32)
+                session.mount('http://', adapter)
+                session.mount('https://', adapter)
+                _download_session = session
+    return _download_session
+
+
+def _expected_length(resp, offset):
+    """根据 Content-Range / Content-Length 计算文件完整长度, 未知时返回 None"""
+    content_range = resp.headers.get('Content-Range')
+    if resp.status_code == 206 and content_range and '/' in content_range:
+        total = content_range.rsplit('/', 1)[-1]
+        return int(total) if total.isdigit() else None
+    content_length = resp.headers.get('Content-Length')
+    if content_length and content_length.isdigit():
+        return int(content_length) + offset
+    return None
+
+
 @retry(stop_max_attempt_number=3)
-def downloader(url, save_path):
+def downloader(url, save_path, session=None, chunk_size=64 * 1024, timeout=60):
     """
     下载附件
+    分块写入 <save_path>.part, 重试时通过 Range 从已下载的位置续传,
+    长度校验通过后再改名为 save_path
     :param url:
     :param save_path:
-    :return:
+    :param session: 默认使用 download_session()
+    :param chunk_size:
+    :param timeout:
+    :return: 文件大小
     """
-    headers = {
-        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) '
-                      'AppleWebKit/537.36 (KHTML, like Gecko) Chrome/92.0.4515.131 Safari/537.36'
-    }
-    resp = requests.get(url, headers=headers)
-    resp.raise_for_status()
-    with open(save_path, 'wb') as f:
-        f.write(resp.content)
+    save_path = Path(save_path)
+    part_path = save_path.with_name(save_path.name + '.part')
+    session = session or download_session()
+    headers = dict(DOWNLOAD_HEADERS)
+    offset = part_path.stat().st_size if part_path.exists() else 0
+    if offset:
+        headers['Range'] = f'bytes={offset}-'
+    with session.get(url, headers=headers, stream=True, timeout=timeout) as resp:
+        if offset and resp.status_code == 416:
+            part_path.unlink()
+            raise IOError(f"range not satisfiable, restart: {url}")
+        resp.raise_for_status()
+        if resp.status_code != 206:
+            offset = 0
+        expected = _expected_length(resp, offset)
+        with open(part_path, 'ab' if offset else 'wb') as f:
+            for chunk in resp.iter_content(chunk_size=chunk_size):
+                if chunk:
+                    f.write(chunk)
+    size = part_path.stat().st_size
+    if expected is not None and size != expected:
+        raise IOError(f"incomplete download: {url}, {size}/{expected} bytes")
+    os.replace(part_path, save_path)
+    return size
 
 
-def save_page(db, table, pages):
+def download_batch(targets, max_workers=4, store=None):
+    """
+    并发下载一批附件
+    :param targets: [(url, save_path)]
+    :param max_workers:
+    :param store: BlobStore, 指定时附件经内容寻址仓库去重后链接到 save_path
+    :return: 与 targets 对应的下载结果 [True/False]
+    """
+    targets = list(targets)
+    if not targets:
+        return []
+
+    def _download(target):
+        url, save_path = target
+        try:
+            if store is not None:
+                store.fetch(url, save_path)
+            else:
+                downloader(url, save_path)
+        except Exception:
+            logger.warning(f"download failed: {url}")
+            return False
+        return True
+
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(targets))) as executor:
+        return list(executor.map(_download, targets))
+
+
+def save_page(db, table, pages, batch_size=DB_BATCH_SIZE, copy_threshold=DB_COPY_THRESHOLD):
     """
     数据入库
+    记录按 batch_size 分批, 每批一条多行 INSERT ... ON CONFLICT DO NOTHING;
+    记录数达到 copy_threshold 时改为 COPY 到临时表后一次性合并.
+    :param db:
+    :param table:
+    :param pages:
+    :param batch_size: 每条 INSERT 携带的记录数
+    :param copy_threshold: 使用 COPY 的记录数下限, 0/None 表示不使用
+    :return: (inserted, skipped)
     """
+    pages = list(pages)
+    if not pages:
+        return 0, 0
+    if copy_threshold and len(pages) >= copy_threshold:
+        inserted = _copy_pages(db, table, pages)
+    else:
+        inserted = _insert_pages(db, table, pages, batch_size)
+    skipped = len(pages) - inserted
+    logger.info(f"Save pages: {len(pages)}, inserted: {inserted}, skipped: {skipped}")
+    return inserted, skipped
+
+
+def _insert_pages(db, table, pages, batch_size):
+    """多行 INSERT, 字段不同的记录分开成批"""
+    groups = dict()
+    for page in pages:
+        groups.setdefault(tuple(sorted(page)), []).append(page)
+    inserted = 0
     with db.engine.connect() as conn:
         with conn.begin():
-            for page in pages:
-                page_insert_stmt = insert(table).values(**page)
-                conn.execute((page_insert_stmt.on_conflict_do_nothing(index_elements=['page_url'])))
-                # on_duplicate_key_stmt = page_insert_stmt.on_duplicate_key_update(**page)
-                # conn.execute(on_duplicate_key_stmt)
+            for group in groups.values():
+                for i in range(0, len(group), batch_size):
+                    page_insert_stmt = insert(table).values(group[i:i + batch_size])
+                    page_insert_stmt = page_insert_stmt.on_conflict_do_nothing(index_elements=['page_url'])
+                    result = conn.execute(page_insert_stmt.returning(table.c.page_url))
+                    inserted += len(result.fetchall())
+    return inserted
+
+
+def _copy_value(value):
+    """COPY text 格式转义"""
+    if value is None:
+        return '\\N'
+    if isinstance(value, datetime):
+        value = value.isoformat(sep=' ')
+    return str(value).replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n').replace('\r', '\\r')
+
+
+def _copy_pages(db, table, pages):
+    """COPY 到临时表, 再 INSERT ... SELECT ... ON CONFLICT DO NOTHING 合并"""
+    preparer = db.engine.dialect.identifier_preparer
+    names = [column.name for column in table.columns if any(column.name in page for page in pages)]
+    columns = ', '.join(preparer.quote(name) for name in names)
+    target = preparer.format_table(table)
+    buffer = io.StringIO()
+    for page in pages:
+        buffer.write('\t'.join(_copy_value(page.get(name)) for name in names))
+        buffer.write('\n')
+    buffer.seek(0)
+
+    raw_conn = db.engine.raw_connection()
+    try:
+        cursor = raw_conn.cursor()
+        cursor.execute(f'CREATE TEMP TABLE _stage_page ON COMMIT DROP AS SELECT {columns} FROM {target} WITH NO DATA')
+        cursor.copy_expert(f'COPY _stage_page ({columns}) FROM STDIN', buffer)
+        cursor.execute(f'INSERT INTO {target} ({columns}) SELECT {columns} FROM _stage_page '
+                       f'ON CONFLICT (page_url) DO NOTHING')
+        inserted = cursor.rowcount
+        raw_conn.commit()
+    except Exception:
+        raw_conn.rollback()
+        raise
+    finally:
+        raw_conn.close()
+    return inserted
+
+
+def update_pages(db, table, pages, columns):
+    """
+    按 page_url 批量更新字段: COPY 到临时表后一条 UPDATE ... FROM 完成
+    :param db:
+    :param table:
+    :param pages: [{page_url, <columns>}]
+    :param columns: 更新的字段
+    :return: 更新的行数
+    """
+    pages = list(pages)
+    if not pages:
+        return 0
+    preparer = db.engine.dialect.identifier_preparer
+    names = ['page_url'] + [name for name in columns if name != 'page_url']
+    quoted = ', '.join(preparer.quote(name) for name in names)
+    target = preparer.format_table(table)
+    assignments = ', '.join(f'{preparer.quote(name)} = s.{preparer.quote(name)}' for name in names[1:])
+    buffer = io.StringIO()
+    for page in pages:
+        buffer.write('\t'.join(_copy_value(page.get(name)) for name in names))
+        buffer.write('\n')
+    buffer.seek(0)
+
+    raw_conn = db.engine.raw_connection()
+    try:
+        cursor = raw_conn.cursor()
+        cursor.execute(f'CREATE TEMP TABLE _stage_update ON COMMIT DROP AS SELECT {quoted} FROM {target} WITH NO DATA')
+        cursor.copy_expert(f'COPY _stage_update ({quoted}) FROM STDIN', buffer)
+        cursor.execute(f'UPDATE {target} AS t SET {assignments} FROM _stage_update AS s '
+                       f'WHERE t.page_url = s.page_url')
+        updated = cursor.rowcount
+        raw_conn.commit()
+    except Exception:
+        raw_conn.rollback()
+        raise
+    finally:
+        raw_conn.close()
+    return updated
 
 
 def load_yaml():